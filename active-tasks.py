@@ -3,11 +3,11 @@
 It looks for an unresolved Jira issues in JIRA_PROJECT
 and notifies backup admins if there are.
 '''
-from jira import JIRA
-
 import config
-from config import logger, email
-from structures import Issue
+from config import logger
+from metrics import report
+from sessions import jira_session
+from structures import Issue, poll_issues
 
 
 JIRA_PROJECT = 'SYSINFR'
@@ -15,31 +15,31 @@ JIRA_PROJECT = 'SYSINFR'
 logger.add(sink=config.LOG_DIR / 'active-tasks.log',
            rotation=config.SETTINGS['logging']['rotation'],
            format=config.SETTINGS['logging']['format'],
-           level='INFO')
+           level='INFO',
+           filter=config.log_filter('active-tasks'))
 
 
 @logger.catch
-def main():
-    jira = JIRA(**config.JIRA)
-    jql = (f'project = {JIRA_PROJECT} AND type = "Backup & Restore" AND '
-           f'status NOT IN (Closed, Rejected, Resolved)')
-
-    opened_issues = []
-    for issue in jira.search_issues(jql, maxResults=False):
-        comments = jira.comments(issue)
-        opened_issues.append(Issue(issue, comments))
-
-    if opened_issues:
-        subject = f'JIRA ({JIRA_PROJECT}) | Active tasks'
-        body = config.SYSINFR_TEMPLATE.render(project=JIRA_PROJECT,
-                                              issues=opened_issues,
-                                              wiki=config.SETTINGS['wiki'])
-        email.notify(subject=subject, message=body)
-        logger.info(f'{len(opened_issues)} tasks are found')
-    else:
-        logger.info('nothing is found')
-
-    jira.close()
+def main(jira=None):
+    try:
+        with jira_session(jira) as jira:
+            jql = (f'project = {JIRA_PROJECT} AND type = "Backup & Restore" AND '
+                   f'status NOT IN (Closed, Rejected, Resolved)')
+
+            # only the issues updated since the previous run are downloaded with their comments
+            opened_issues = [Issue(issue) for issue in poll_issues(jira, 'active-tasks', jql)]
+
+            if opened_issues:
+                subject = f'JIRA ({JIRA_PROJECT}) | Active tasks'
+                body = config.SYSINFR_TEMPLATE.render(project=JIRA_PROJECT,
+                                                      issues=opened_issues,
+                                                      wiki=config.SETTINGS['wiki'])
+                config.email.notify(subject=subject, message=body)
+                logger.info(f'{len(opened_issues)} tasks are found')
+            else:
+                logger.info('nothing is found')
+    finally:
+        report('active-tasks')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+'''
+Lean client of the Commvault REST API.
+
+Unlike cvpysdk.commcell.Commcell, it doesn't request the CommCell's metadata
+on login, so each operation costs only the requests it needs.
+'''
+import time
+import socket
+import threading
+from base64 import b64encode
+from collections import defaultdict
+from functools import partial
+from json.decoder import JSONDecodeError
+
+from loguru import logger
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib.parse import urljoin, urlsplit
+from urllib3.util.retry import Retry
+
+import config
+from metrics import instrument_session
+from tokens import get_token, invalidate_token
+
+
+REQUEST_TIMEOUT = 30
+RETRY_STRATEGY = Retry(
+    total=3,
+    backoff_factor=2,
+    status_forcelist=[429, 500, 502, 503, 504]
+)
+
+# hours of the finished jobs which are listed among the active ones (as cvpysdk does)
+ACTIVE_JOBS_LOOKUP_TIME = 5
+
+
+class CommvaultError(Exception):
+    '''The request has failed or Commvault has refused the operation'''
+
+
+class RateLimiter:
+    '''Spaces out calls shared between threads to the given rate per second'''
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''Block until the next call is allowed'''
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BaseUrlSession(Session):
+    '''A Session with a URL that all requests will use as a base'''
+
+    def __init__(self, base_url, rate_limit=0, http_cache=None):
+        self.base_url = base_url
+        self.rate_limiters = defaultdict(lambda: RateLimiter(rate_limit))
+        self.http_cache = http_cache
+        Session.__init__(self)
+
+    def request(self, method, url, *args, **kwargs):
+        '''Send the request after generating the complete URL'''
+        path, url = url, self.create_url(url)
+        if method == 'GET' and self.http_cache:
+            headers = kwargs.pop('headers', None) or {}
+            return self.http_cache.request(path, url, lambda conditions: self.request_url(
+                method, url, *args, headers={**headers, **conditions}, **kwargs
+            ))
+        return self.request_url(method, url, *args, **kwargs)
+
+    def request_url(self, method, url, *args, **kwargs):
+        '''Send the request to the complete URL'''
+        self.rate_limiters[urlsplit(url).netloc].wait()
+        return Session.request(self, method, url, *args, **kwargs)
+
+    def create_url(self, url):
+        '''Create the URL based off the partial path'''
+        return urljoin(self.base_url, url)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    '''HTTPAdapter with a default timeout'''
+
+    def __init__(self, *args, **kwargs):
+        self.timeout = kwargs.pop('timeout', REQUEST_TIMEOUT)
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def send(self, request, **kwargs):
+        kwargs['timeout'] = kwargs.get('timeout', self.timeout)
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+class Commvault:
+    '''Client groups and jobs operations used by sox-parser.py and suspend-jobs.py'''
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.client_groups = None
+
+    def request(self, method, path, payload=None):
+        '''Make the API request, the failed one raises CommvaultError'''
+        try:
+            return send_request(self.session, method, path, payload)
+        except RequestException as error:
+            raise CommvaultError(f'{method} {path}: {error}') from error
+
+    def get_client_group_id(self, group_name):
+        '''Returns ID of the client group by its name (case-insensitive)'''
+        # the client groups are listed once and shared by the threads
+        with self.lock:
+            if self.client_groups is None:
+                resp_json = self.request('GET', 'ClientGroup')
+                self.client_groups = {group['name'].lower(): group['Id']
+                                      for group in resp_json.get('groups', [])}
+        try:
+            return self.client_groups[group_name.lower()]
+        except KeyError:
+            raise CommvaultError(f'client group ({group_name}) is not found') from None
+
+    def get_group_clients(self, group_name):
+        '''Returns the clients of the client group: {client_id: client_name}'''
+        group_id = self.get_client_group_id(group_name)
+        resp_json = self.request('GET', f'ClientGroup/{group_id}')
+        return {int(client['clientId']): client['clientName']
+                for client in resp_json['clientGroupDetail'].get('associatedClients', [])}
+
+    def get_jobs(self, request_json):
+        '''Returns the page of the jobs by the filter of the request'''
+        return self.request('POST', 'Jobs', request_json) or {}
+
+    def get_active_jobs(self, job_types, limit):
+        '''Returns the summaries of the active jobs of the types: {job_id: summary}'''
+        resp_json = self.get_jobs({
+            'scope': 1,
+            'category': 1,
+            'pagingConfig': {
+                'sortDirection': 1,
+                'offset': 0,
+                'sortField': 'jobId',
+                'limit': limit,
+            },
+            'jobFilter': {
+                'completedJobLookupTime': ACTIVE_JOBS_LOOKUP_TIME * 60 * 60,
+                'showAgedJobs': False,
+                'clientList': [],
+                'jobTypeList': job_types,
+            },
+        })
+        return {job['jobSummary']['jobId']: job['jobSummary']
+                for job in resp_json.get('jobs', [])
+                if 'jobSummary' in job and job['jobSummary'].get('isVisible', True)}
+
+    def get_job_details(self, job_id):
+        '''Returns the details of the job (jobDetail)'''
+        resp_json = self.request('POST', 'JobDetails', {'jobId': int(job_id)})
+        try:
+            return resp_json['job']['jobDetail']
+        except (KeyError, TypeError):
+            raise CommvaultError(f'job ({job_id}) is not found') from None
+
+    def pause_job(self, job_id):
+        '''Sends the request to suspend the job without waiting for it'''
+        self.job_action(job_id, 'pause')
+
+    def resume_job(self, job_id):
+        '''Sends the request to resume the job without waiting for it'''
+        self.job_action(job_id, 'resume')
+
+    def job_action(self, job_id, action):
+        resp_json = self.request('POST', f'Job/{job_id}/action/{action}')
+        if not isinstance(resp_json, dict):
+            return
+        for error in resp_json.get('errors', []):
+            for item in error.get('errList', []):
+                if item.get('errorCode'):
+                    raise CommvaultError(item.get('errLogMessage') or
+                                         f'error code {item["errorCode"]}')
+
+    def close(self):
+        '''Close the session
+
+        The token isn't logged out, because it is shared with other scripts.
+        '''
+        self.session.close()
+
+
+def create_session(rate_limit=0, pool_size=10, http_cache=None):
+    '''Create the session with the stored token or make login request'''
+    hostname = config.COMMVAULT['webconsole_hostname']
+    adapter = TimeoutHTTPAdapter(max_retries=RETRY_STRATEGY, pool_maxsize=pool_size)
+
+    session = BaseUrlSession(f'http://{hostname}/webconsole/api/', rate_limit, http_cache)
+    instrument_session(session)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept': 'application/json',
+                            'Content-Type': 'application/json'})
+
+    session.headers['Authtoken'] = get_token(partial(is_token_valid, session),
+                                             partial(request_token, session))
+    return session
+
+
+def request_token(session):
+    '''Make login request'''
+    resp_json = send_request(session, 'POST', 'Login', payload={
+        'mode': 4,
+        'username': config.COMMVAULT['commcell_username'],
+        'password': b64encode(config.COMMVAULT['commcell_password'].encode()).decode(),
+        'deviceId': socket.getfqdn(),
+        'clientType': 30,
+    })
+    return resp_json['token']
+
+
+def is_token_valid(session, token):
+    '''Check the token with the cheap WhoAmI request'''
+    response = session.request('GET', 'WhoAmI', headers={'Authtoken': token})
+    return response.ok
+
+
+def renew_token(session, expired_token):
+    '''Replace the expired token of the session with a valid one'''
+    logger.info('Commvault token is expired, it will be renewed')
+    invalidate_token(expired_token)
+    session.headers['Authtoken'] = get_token(partial(is_token_valid, session),
+                                             partial(request_token, session))
+
+
+def send_request(session, method, path, payload=None):
+    '''Send the request to the Commcell'''
+    # the session is shared between threads, so headers are set per request
+    if method == 'POST' and not payload:
+        headers = {'Content-Type': 'application/xml'}
+    else:
+        headers = {'Content-Type': 'application/json'}
+
+    try:
+        token = session.headers.get('Authtoken')
+        response = session.request(method, path, json=payload, headers=headers)
+        if response.status_code == 401 and token and path != 'Login':
+            renew_token(session, token)
+            response = session.request(method, path, json=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()
+    except JSONDecodeError:
+        return response
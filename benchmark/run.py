@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+'''
+It runs the scripts end to end against the local servers (see server.py)
+and reports the wall time, the requests and the peak memory of each run.
+
+The scripts are copied into a temporary directory with generated settings,
+so the reports, logs and state of the runs don't touch the project's ones.
+The state is kept between the scripts and the repeats of one benchmark,
+like it is kept between cron runs.
+
+    python benchmark/run.py --clients 50 --latency 20 --repeat 3
+    python benchmark/run.py --scripts "service-details.py incremental" --workers 1 8
+    python benchmark/run.py --scripts service-details.py --set commvault.bulk_requests=yes
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import yaml
+
+from server import make_estate, parse_estate_args, start_servers
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SCRIPTS = ['service-details.py', 'sox-parser.py', 'active-tasks.py']
+
+ENVIRONMENT = {
+    'COMMVAULT_USERNAME': 'benchmark',
+    'COMMVAULT_PASSWORD': 'benchmark',
+    'JIRA_USERNAME': 'benchmark',
+    'JIRA_PASSWORD': 'benchmark',
+    'SMTP_USERNAME': 'benchmark',
+    'SMTP_PASSWORD': 'benchmark',
+}
+
+
+def main():
+    parser = parse_estate_args(argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--scripts', nargs='+', default=SCRIPTS,
+                        help='scripts with their arguments (default: %(default)s)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='values of commvault.workers to compare')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each script')
+    parser.add_argument('--json', type=Path, help='file to save the results')
+    parser.add_argument('--set', nargs='+', default=[], metavar='KEY=VALUE',
+                        help='settings to override, e.g. commvault.bulk_requests=yes')
+    parser.add_argument('--work-dir', type=Path,
+                        help='directory to run the scripts in and keep their logs '
+                             '(default: temporary one)')
+    args = parser.parse_args()
+
+    estate = make_estate(args)
+    servers = start_servers(estate, latency=args.latency / 1000)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='commvault-benchmark-') as work_dir:
+        work_dir = args.work_dir or Path(work_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        for workers in args.workers:
+            prepare_work_dir(work_dir, estate, servers, workers, args.set)
+            for script in args.scripts:
+                for number in range(1, args.repeat + 1):
+                    result = run_script(work_dir, script, servers)
+                    result.update(workers=workers, run=number)
+                    results.append(result)
+                    print_result(result)
+
+    for server in servers.values():
+        server.shutdown()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf8')
+
+
+def prepare_work_dir(work_dir, estate, servers, workers, overrides=()):
+    '''Copies the scripts and writes the settings pointed to the local servers'''
+    for path in BASE_DIR.glob('*.py'):
+        shutil.copy(path, work_dir)
+    shutil.copytree(BASE_DIR / 'templates', work_dir / 'templates', dirs_exist_ok=True)
+    # the previous reports and state belong to another number of workers
+    for name in ('reports', 'state', 'logs'):
+        shutil.rmtree(work_dir / name, ignore_errors=True)
+
+    settings = yaml.safe_load((BASE_DIR / 'example' / 'settings.yml').read_text())
+    settings['commvault'].update(api=servers['commvault'].address,
+                                 workers=workers,
+                                 rate_limit=0)
+    settings['jira'] = servers['jira'].url
+    settings['smtp'].update(host=servers['smtp'].server_address[0],
+                            port=servers['smtp'].server_address[1],
+                            tls=False)
+    settings['sox_services'] = list(estate.groups.values())
+    settings['admin_services'] = []
+    for override in overrides:
+        key, value = override.split('=', 1)
+        *sections, name = key.split('.')
+        section = settings
+        for section_name in sections:
+            section = section.setdefault(section_name, {})
+        section[name] = yaml.safe_load(value)
+    (work_dir / 'settings.yml').write_text(yaml.safe_dump(settings), encoding='utf8')
+
+    services = '\n'.join(['[services]', *estate.groups.values()])
+    (work_dir / 'services.ini').write_text(services + '\n', encoding='utf8')
+
+
+def run_script(work_dir, script, servers):
+    '''Runs the script and returns its wall time, peak memory and requests'''
+    for server in servers.values():
+        server.stats.reset()
+
+    command = shlex.split(script)
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, *command], cwd=work_dir,
+                               env=dict(os.environ, **ENVIRONMENT))
+    # unlike Popen.wait(), wait4() returns the resources used by the process
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.monotonic() - started
+
+    return {
+        'script': script,
+        'exit_code': process.returncode,
+        'seconds': round(elapsed, 3),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        # kilobytes on Linux
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'requests': {name: server.stats.snapshot()['requests']
+                     for name, server in servers.items()},
+        'bytes': {name: sum(server.stats.snapshot()['bytes'].values())
+                  for name, server in servers.items()},
+    }
+
+
+def print_result(result):
+    requests = {name: sum(counts.values()) for name, counts in result['requests'].items()}
+    print(f'{result["script"]:<32} workers={result["workers"]:<3} run={result["run"]:<2} '
+          f'exit={result["exit_code"]:<2} {result["seconds"]:>8.2f}s '
+          f'cpu={result["cpu_seconds"]:>6.2f}s rss={result["max_rss_mb"]:>6.1f}MB '
+          f'commvault={requests["commvault"]} jira={requests["jira"]} '
+          f'smtp={requests["smtp"]}')
+    for name, counts in result['requests'].items():
+        for endpoint, count in sorted(counts.items(), key=lambda item: -item[1]):
+            print(f'    {name:<10} {endpoint:<48} {count:>6}')
+
+
+if __name__ == '__main__':
+    main()
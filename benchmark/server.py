@@ -0,0 +1,759 @@
+#!/usr/bin/env python3
+'''
+Local stand-in of the Commvault, Jira and SMTP servers for the benchmarks.
+
+It serves a synthetic estate of the configured size with the configured
+latency per request, so the scripts can be run end to end offline.
+Each server counts the requests by endpoints, see Stats.
+
+    python benchmark/server.py --clients 50 --latency 20
+'''
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import socketserver
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+# statuses of the generated jobs with their weights
+JOB_STATUSES = {
+    'Completed': 70,
+    'Completed w/ one or more errors': 10,
+    'Failed': 5,
+    'Running': 5,
+    'Pending': 5,
+    'Killed': 3,
+    'Committed': 2,
+}
+
+AGENTS = ['File System', 'SQL Server', 'Oracle', 'Virtual Server']
+
+# operation types of the jobs: {code: name}
+JOB_TYPES = {4: 'Backup', 31: 'Data Verification'}
+
+# statuses of the jobs which are listed as active ones
+ACTIVE_STATUSES = {'running', 'pending', 'waiting', 'suspended'}
+
+FAILURE_REASONS = [
+    'Failed to mount the disk',
+    'Unable to quiesce guest file system during snapshot creation',
+    'The job has exceeded the total running time',
+    'Backup activity for subclient [default] is disabled',
+]
+
+# the client which backs up the VMs by the Virtual Server jobs
+HYPERVISOR_NAME = 'srv-vsa-001'
+
+JIRA_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000+0000'
+
+
+class Estate:
+    '''Synthetic Commvault clients, their jobs and Jira issues
+
+    Each client group is a service with `clients` clients, each client has
+    `subclients` subclients and `jobs` backup jobs. Every third client is a VM
+    backed up by the hypervisor's Virtual Server jobs. Each service has one
+    running Data Verification job.
+    '''
+
+    def __init__(self, services=2, clients=10, subclients=3, jobs=5, comments=5, seed=1):
+        rand = random.Random(seed)
+        now = int(time.time())
+
+        self.groups = {}
+        self.clients = {}
+        self.subclients = {}
+        self.jobs = {}
+        self.policies = {policy_id: f'SP-{policy_id:02}' for policy_id in range(1, 6)}
+
+        self.hypervisor_id = 1
+        self.clients[self.hypervisor_id] = {'name': HYPERVISOR_NAME, 'group': None,
+                                            'subclients': [1], 'jobs': []}
+        self.subclients[1] = {'client_id': self.hypervisor_id, 'name': 'default',
+                              'agent': 'Virtual Server', 'enabled': True,
+                              'policy_id': 1, 'last_job_id': None}
+
+        for group_id in range(1, services + 1):
+            self.groups[group_id] = f'Service {group_id:03}'
+            for _ in range(clients):
+                client_id = len(self.clients) + 1
+                client = {
+                    'name': f'srv-{group_id:03}-{client_id:05}',
+                    'group': group_id,
+                    'vm': client_id % 3 == 0,
+                    'subclients': [],
+                    'jobs': [],
+                }
+                self.clients[client_id] = client
+
+                for number in range(subclients):
+                    subclient_id = len(self.subclients) + 1
+                    agent = AGENTS[number % 3]
+                    self.subclients[subclient_id] = {
+                        'client_id': client_id,
+                        'name': 'default' if number == 0 else f'subclient-{number}',
+                        'agent': agent,
+                        'enabled': rand.random() > 0.1,
+                        'policy_id': rand.choice(list(self.policies)),
+                        'last_job_id': None,
+                    }
+                    client['subclients'].append(subclient_id)
+
+                for _ in range(jobs):
+                    job_id = len(self.jobs) + 1000
+                    subclient_id = rand.choice(client['subclients'])
+                    status = rand.choices(list(JOB_STATUSES), list(JOB_STATUSES.values()))[0]
+                    started = now - rand.randint(600, 20 * 3600)
+                    self.jobs[job_id] = {
+                        'type': 4,
+                        'client_id': client_id,
+                        'subclient_id': subclient_id,
+                        'agent': self.subclients[subclient_id]['agent'],
+                        'status': status,
+                        'started': started,
+                        'finished': started + rand.randint(60, 3600),
+                        'failed_files': rand.choice([0, 0, 0, 3]),
+                        'failed_folders': rand.choice([0, 0, 0, 1]),
+                        'reason': rand.choice(FAILURE_REASONS) if status != 'Completed' else '',
+                        'vms': [],
+                    }
+                    client['jobs'].append(job_id)
+                    self.subclients[subclient_id]['last_job_id'] = job_id
+
+        # the VMs are backed up by the hypervisor's jobs, a few of them with errors
+        vms = [client['name'] for client in self.clients.values() if client.get('vm')]
+        for number in range(max(1, len(vms) // 20)):
+            job_id = len(self.jobs) + 1000
+            self.jobs[job_id] = {
+                'type': 4,
+                'client_id': self.hypervisor_id,
+                'subclient_id': None,
+                'agent': 'Virtual Server',
+                'status': 'Completed w/ one or more errors',
+                'started': now - 3600,
+                'finished': now - 600,
+                'failed_files': 0,
+                'failed_folders': 0,
+                'reason': '',
+                'vms': [{'vmName': name,
+                         'FailureReason': rand.choice(FAILURE_REASONS[:2])
+                         if rand.random() < 0.2 else ''}
+                        for name in vms[number::max(1, len(vms) // 20)]],
+            }
+            self.clients[self.hypervisor_id]['jobs'].append(job_id)
+
+        for group_id in self.groups:
+            client_id = self.group_clients(group_id)[0]
+            job_id = len(self.jobs) + 1000
+            self.jobs[job_id] = {
+                'type': 31,
+                'client_id': client_id,
+                'subclient_id': self.clients[client_id]['subclients'][0],
+                'agent': 'File System',
+                'status': 'Running',
+                'started': now - 1800,
+                'finished': 0,
+                'failed_files': 0,
+                'failed_folders': 0,
+                'reason': '',
+                'vms': [],
+            }
+            self.clients[client_id]['jobs'].append(job_id)
+
+        self.issues = self.generate_issues(rand, comments)
+
+    def generate_issues(self, rand, comments):
+        '''Returns Jira issues: today's SOX JobSummary of each service,
+        opened SOX issues of the last days and active SYSINFR tasks'''
+        now = datetime.utcnow()
+        issues = []
+
+        def add_issue(project, summary, created, status='Open', type_='Task'):
+            number = sum(issue['key'].startswith(project + '-') for issue in issues) + 1
+            issue = {
+                'id': str(10000 + len(issues)),
+                'key': f'{project}-{number}',
+                'fields': {
+                    'summary': summary,
+                    'status': {'name': status},
+                    'issuetype': {'name': type_},
+                    'assignee': {'name': f'owner{rand.randint(1, 5)}',
+                                 'displayName': f'Owner {rand.randint(1, 5)}'},
+                    'reporter': {'name': 'jirabot', 'displayName': 'Jira Bot'},
+                    'created': created.strftime(JIRA_TIME_FORMAT),
+                    'updated': created.strftime(JIRA_TIME_FORMAT),
+                    'comment': {'comments': [], 'maxResults': 0, 'total': 0, 'startAt': 0},
+                },
+            }
+            for number in range(rand.randint(0, comments)):
+                issue['fields']['comment']['comments'].append({
+                    'id': str(len(issues) * 100 + number),
+                    'author': {'name': 'jirabot', 'displayName': 'Jira Bot'},
+                    'body': (f'srv-{number:03} ({1000 + number}): {{color:red}}'
+                             f'{rand.choice(FAILURE_REASONS)}{{color}}\xa0checked'),
+                    'created': created.strftime(JIRA_TIME_FORMAT),
+                    'updated': created.strftime(JIRA_TIME_FORMAT),
+                })
+            issue['fields']['comment']['total'] = len(issue['fields']['comment']['comments'])
+            issue['fields']['comment']['maxResults'] = issue['fields']['comment']['total']
+            issues.append(issue)
+
+        for group_name in self.groups.values():
+            add_issue('SOX', f'JobSummary_[{group_name}]', now)
+            for days in range(1, 4):
+                add_issue('SOX', f'JobSummary_[{group_name}]', now - timedelta(days=days))
+        for number in range(len(self.groups) * 5):
+            add_issue('SYSINFR', f'Restore request {number}', now - timedelta(days=number),
+                      status='In Progress', type_='Backup & Restore')
+        return issues
+
+    def group_clients(self, group_id):
+        return [client_id for client_id, client in self.clients.items()
+                if client['group'] == group_id]
+
+
+class Stats:
+    '''Thread-safe counters of the requests and bytes sent by endpoints'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes = Counter()
+
+    def add(self, endpoint, size):
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.bytes[endpoint] += size
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.bytes.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'bytes': dict(self.bytes)}
+
+
+def endpoint_template(path):
+    '''Replaces the IDs of the path: Subclient/15 -> Subclient/{id}'''
+    path = re.sub(r'(?<!/api)/\d+', '/{id}', path.rstrip('/'))
+    return re.sub(r'/[A-Z]+-\d+', '/{key}', path)
+
+
+class BaseHandler(BaseHTTPRequestHandler):
+    '''Dispatches the requests to the handler's methods by ROUTES
+
+    ROUTES: [(method, regex of the path, name of the method)], the method
+    gets the match of the path, the query and the JSON payload.
+    '''
+    ROUTES = []
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, so Nagle's algorithm
+    # would delay every keep-alive response until the client's ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = None
+
+        url = urlsplit(self.path)
+        path = url.path[len(self.server.prefix):]
+        time.sleep(self.server.latency)
+
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                status, response = getattr(self, handler)(match, parse_qs(url.query), payload)
+                break
+        else:
+            status, response = 404, {'errorMessage': f'{method} {path} is not emulated'}
+
+        content = json.dumps(response).encode() if response is not None else b''
+        self.server.stats.add(f'{method} {endpoint_template(path)}', len(content))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class CommvaultHandler(BaseHandler):
+    '''Emulates the endpoints of the Commvault REST API used by the scripts'''
+    ROUTES = [
+        ('GET', '', 'service'),
+        ('POST', 'Login', 'login'),
+        ('GET', 'WhoAmI', 'who_am_i'),
+        ('POST', 'WhoAmI', 'who_am_i'),
+        ('GET', 'CommServ', 'commserv'),
+        ('GET', 'ClientGroup', 'client_groups'),
+        ('GET', r'ClientGroup/(\d+)', 'client_group'),
+        ('GET', 'Client', 'clients'),
+        ('GET', r'Client/(\d+)', 'client'),
+        ('GET', 'Subclient/?', 'subclients'),
+        ('GET', r'Subclient/(\d+)', 'subclient'),
+        ('GET', 'Job', 'client_jobs'),
+        ('GET', r'Job/(\d+)', 'job'),
+        ('POST', 'Jobs', 'jobs'),
+        ('POST', 'JobDetails', 'job_details'),
+        ('POST', r'Job/(\d+)/action/(pause|resume)', 'job_action'),
+        ('GET', r'StoragePolicy/(\d+)', 'storage_policy'),
+        ('GET', 'Schedules/?', 'schedules'),
+    ]
+
+    def authorized(self):
+        return self.headers.get('Authtoken') in self.server.tokens
+
+    def dispatch(self, method):
+        path = urlsplit(self.path).path[len(self.server.prefix):]
+        if path not in ('', 'Login') and not self.authorized():
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            self.server.stats.add(f'{method} {endpoint_template(path)} (401)', 0)
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        super().dispatch(method)
+
+    def service(self, match, query, payload):
+        return 200, {}
+
+    def login(self, match, query, payload):
+        token = f'QSDK {len(self.server.tokens) + 1:08x}'
+        self.server.tokens.add(token)
+        return 200, {'token': token, 'userName': payload.get('username'), 'errList': []}
+
+    def who_am_i(self, match, query, payload):
+        return 200, {'user': {'userName': 'benchmark', 'userId': 1}}
+
+    def commserv(self, match, query, payload):
+        return 200, {
+            'commcell': {'csGUID': 'benchmark', 'commCellName': 'benchmark', 'commCellId': 2},
+            'hostName': 'localhost',
+            'csTimeZone': {'TimeZoneName': '(UTC) Coordinated Universal Time'},
+            'timeZone': '0:-1:(UTC) Coordinated Universal Time',
+            'currentSPVersion': 20,
+            'csVersionInfo': '11.20.0',
+        }
+
+    def client_groups(self, match, query, payload):
+        return 200, {'groups': [{'name': name, 'Id': group_id}
+                                for group_id, name in self.server.estate.groups.items()]}
+
+    def client_group(self, match, query, payload):
+        group_id = int(match[1])
+        estate = self.server.estate
+        if group_id not in estate.groups:
+            return 404, None
+        return 200, {'clientGroupDetail': {
+            'clientGroup': {'clientGroupId': group_id,
+                            'clientGroupName': estate.groups[group_id]},
+            'description': '',
+            'associatedClients': [self.client_entity(client_id)
+                                  for client_id in estate.group_clients(group_id)],
+        }}
+
+    def client_entity(self, client_id):
+        name = self.server.estate.clients[client_id]['name']
+        return {'clientId': client_id, 'clientName': name, 'displayName': name,
+                'hostName': f'{name}.example.com'}
+
+    def clients(self, match, query, payload):
+        return 200, {'clientProperties': [
+            {'client': {'clientEntity': self.client_entity(client_id)}}
+            for client_id in self.server.estate.clients
+        ]}
+
+    def client(self, match, query, payload):
+        client_id = int(match[1])
+        client = self.server.estate.clients.get(client_id)
+        if not client:
+            return 404, None
+        properties = {'client': {
+            'clientEntity': self.client_entity(client_id),
+            'osInfo': {'OsDisplayInfo': {'OSName': 'Windows Server 2016 Standard'}},
+        }}
+        if client.get('vm'):
+            estate = self.server.estate
+            properties['vmStatusInfo'] = {
+                'subclientName': 'default',
+                'vsaSubClientEntity': self.subclient_entity(
+                    estate.clients[estate.hypervisor_id]['subclients'][0]),
+            }
+        return 200, {'clientProperties': [properties]}
+
+    def subclient_entity(self, subclient_id):
+        subclient = self.server.estate.subclients[subclient_id]
+        return {
+            'subclientId': subclient_id,
+            'subclientName': subclient['name'],
+            'clientId': subclient['client_id'],
+            'clientName': self.server.estate.clients[subclient['client_id']]['name'],
+            'appName': subclient['agent'],
+            'backupsetName': 'defaultBackupSet',
+            'instanceName': 'DEFAULT',
+        }
+
+    def subclients(self, match, query, payload):
+        client_id = int(query['clientId'][0])
+        client = self.server.estate.clients.get(client_id)
+        if not client:
+            return 404, None
+        # propertyLevel=20 lists the subclients with all their properties
+        if int(query.get('propertyLevel', [0])[0]) >= 20:
+            return 200, {'subClientProperties': [self.subclient_properties(subclient_id)
+                                                 for subclient_id in client['subclients']]}
+        return 200, {'subClientProperties': [
+            {'subClientEntity': self.subclient_entity(subclient_id)}
+            for subclient_id in client['subclients']
+        ]}
+
+    def subclient(self, match, query, payload):
+        subclient_id = int(match[1])
+        if subclient_id not in self.server.estate.subclients:
+            return 404, None
+        return 200, {'subClientProperties': [self.subclient_properties(subclient_id)]}
+
+    def subclient_properties(self, subclient_id):
+        subclient = self.server.estate.subclients[subclient_id]
+        return {
+            'subClientEntity': self.subclient_entity(subclient_id),
+            'commonProperties': {
+                'enableBackup': subclient['enabled'],
+                'lastBackupJobInfo': {'jobID': subclient['last_job_id'] or 0},
+                'storageDevice': {'dataBackupStoragePolicy': {
+                    'storagePolicyId': subclient['policy_id'],
+                    'storagePolicyName': self.server.estate.policies[subclient['policy_id']],
+                }},
+            },
+            'content': [{'path': 'C:\\'}, {'path': 'D:\\Data'}, {'excludePath': 'C:\\Temp'}],
+        }
+
+    def job_summary(self, job_id):
+        job = self.server.estate.jobs[job_id]
+        client = self.server.estate.clients[job['client_id']]
+        subclient = self.server.estate.subclients.get(job['subclient_id'], {})
+        return {
+            'jobId': job_id,
+            'status': job['status'],
+            'jobType': JOB_TYPES[job['type']],
+            'localizedOperationName': JOB_TYPES[job['type']],
+            'isVisible': True,
+            'appTypeName': job['agent'],
+            'percentComplete': 100 if job['status'].startswith('Completed') else 42,
+            'pendingReason': job['reason'],
+            'totalFailedFiles': job['failed_files'],
+            'totalFailedFolders': job['failed_folders'],
+            'jobStartTime': job['started'],
+            'jobEndTime': job['finished'],
+            'lastUpdateTime': job['finished'],
+            'subclient': {'clientId': job['client_id'],
+                          'clientName': client['name'],
+                          'subclientId': job['subclient_id'],
+                          'subclientName': subclient.get('name', 'default'),
+                          'appName': job['agent']},
+        }
+
+    def client_jobs(self, match, query, payload):
+        client_id = int(query['clientId'][0])
+        client = self.server.estate.clients.get(client_id)
+        if not client:
+            return 404, None
+        return 200, {'jobs': [{'jobSummary': self.job_summary(job_id)}
+                              for job_id in client['jobs']],
+                     'totalRecordsWithoutPaging': len(client['jobs'])}
+
+    def job(self, match, query, payload):
+        job_id = int(match[1])
+        if job_id not in self.server.estate.jobs:
+            return 200, {'totalRecordsWithoutPaging': 0}
+        return 200, {'jobs': [{'jobSummary': self.job_summary(job_id)}],
+                     'totalRecordsWithoutPaging': 1}
+
+    def jobs(self, match, query, payload):
+        job_filter = payload.get('jobFilter', {})
+        paging = payload.get('pagingConfig', {})
+        client_ids = {item['clientId'] for item in job_filter.get('clientList', [])}
+        # as the real API, the Virtual Server jobs are also listed for the VMs they have backed up
+        vm_names = {self.server.estate.clients[client_id]['name'] for client_id in client_ids
+                    if self.server.estate.clients.get(client_id, {}).get('vm')}
+        job_types = set(job_filter.get('jobTypeList', []))
+        # 0 - all, 1 - active, 2 - finished
+        category = payload.get('category', 0)
+
+        job_ids = []
+        for job_id, job in self.server.estate.jobs.items():
+            if (client_ids and job['client_id'] not in client_ids and
+                    not any(vm['vmName'] in vm_names for vm in job['vms'])):
+                continue
+            if job_types and job['type'] not in job_types:
+                continue
+            if category and (job['status'].lower() in ACTIVE_STATUSES) != (category == 1):
+                continue
+            job_ids.append(job_id)
+
+        offset = paging.get('offset', 0)
+        limit = paging.get('limit', 100)
+        return 200, {'jobs': [{'jobSummary': self.job_summary(job_id)}
+                              for job_id in job_ids[offset:offset + limit]],
+                     'totalRecordsWithoutPaging': len(job_ids)}
+
+    def job_details(self, match, query, payload):
+        job_id = payload['jobId']
+        job = self.server.estate.jobs.get(job_id)
+        if not job:
+            return 200, {}
+        return 200, {'job': {'jobDetail': {
+            'generalInfo': {'jobId': job_id},
+            'clientStatusInfo': {'vmStatus': job['vms']},
+        }}}
+
+    def job_action(self, match, query, payload):
+        job = self.server.estate.jobs.get(int(match[1]))
+        if not job:
+            return 200, {'errors': [{'errList': [{'errorCode': 1, 'errLogMessage': 'not found'}]}]}
+        job['status'] = 'Suspended' if match[2] == 'pause' else 'Running'
+        return 200, {}
+
+    def storage_policy(self, match, query, payload):
+        return 200, {'copy': [{'retentionRules': {'retainBackupDataForDays': 30,
+                                                  'retainBackupDataForCycles': 2}}]}
+
+    def schedules(self, match, query, payload):
+        return 200, {'taskDetail': [{'subTasks': [
+            {'options': {'backupOpts': {'backupLevel': 2}},
+             'pattern': {'description': 'Daily at 10:00 PM starting May 1, 2020 and repeats'}},
+            {'options': {'backupOpts': {'backupLevel': 1}},
+             'pattern': {'description': 'Weekly on Sunday at 8:00 PM starting May 3, 2020 '
+                                        'and repeats'}},
+        ]}]}
+
+
+class JiraHandler(BaseHandler):
+    '''Emulates the Jira REST API calls made by the scripts
+
+    JQL isn't parsed, the issues are filtered by the project, the JobSummary
+    and Open/Backup & Restore conditions and created >= startOfDay().
+    '''
+    ROUTES = [
+        ('GET', 'rest/api/2/serverInfo', 'server_info'),
+        ('GET', 'rest/api/2/field', 'fields'),
+        ('GET', 'rest/api/2/search', 'search'),
+        ('POST', 'rest/api/2/search', 'search'),
+        ('GET', r'rest/api/2/issue/([A-Z]+-\d+)', 'issue'),
+        ('POST', r'rest/api/2/issue/([A-Z]+-\d+)/comment', 'add_comment'),
+        ('GET', r'rest/api/2/issue/([A-Z]+-\d+)/transitions', 'transitions'),
+        ('POST', r'rest/api/2/issue/([A-Z]+-\d+)/transitions', 'transition'),
+    ]
+
+    def server_info(self, match, query, payload):
+        return 200, {'baseUrl': self.server.url, 'version': '8.5.0',
+                     'versionNumbers': [8, 5, 0], 'deploymentType': 'Server'}
+
+    def fields(self, match, query, payload):
+        return 200, [{'id': name, 'name': name, 'custom': False}
+                     for name in ('summary', 'status', 'assignee', 'reporter',
+                                  'created', 'updated', 'comment', 'issuetype')]
+
+    def find_issues(self, jql):
+        project = re.search(r'project\s*=\s*(\w+)', jql)
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        issues = []
+        for issue in self.server.estate.issues:
+            fields = issue['fields']
+            if project and not issue['key'].startswith(project[1] + '-'):
+                continue
+            if 'JobSummary' in jql and 'JobSummary' not in fields['summary']:
+                continue
+            if 'status = Open' in jql and fields['status']['name'] != 'Open':
+                continue
+            if 'startOfDay()' in jql and not fields['created'].startswith(today):
+                continue
+            if 'Backup & Restore' in jql and fields['issuetype']['name'] != 'Backup & Restore':
+                continue
+            keys = re.search(r'key in \(([^)]*)\)', jql)
+            if keys and issue['key'] not in keys[1].replace(' ', '').split(','):
+                continue
+            updated = re.search(r'updated\s*>\s*"([^"]+)"', jql)
+            if updated and fields['updated'][:16].replace('T', ' ') <= updated[1]:
+                continue
+            issues.append(issue)
+        return issues
+
+    def search(self, match, query, payload):
+        if payload is None:
+            payload = {name: ','.join(values) for name, values in query.items()}
+        issues = self.find_issues(payload.get('jql', ''))
+        start = int(payload.get('startAt', 0))
+        limit = int(payload.get('maxResults', 50))
+        fields = payload.get('fields') or '*all'
+        if isinstance(fields, str):
+            fields = fields.split(',')
+
+        page = []
+        for issue in issues[start:start + limit]:
+            if '*all' not in fields:
+                issue = dict(issue, fields={name: value for name, value in issue['fields'].items()
+                                            if name in fields})
+            page.append(dict(issue, self=f'{self.server.url}/rest/api/2/issue/{issue["id"]}'))
+        return 200, {'startAt': start, 'maxResults': limit, 'total': len(issues),
+                     'issues': page}
+
+    def get_issue(self, key):
+        for issue in self.server.estate.issues:
+            if issue['key'] == key:
+                return issue
+
+    def issue(self, match, query, payload):
+        issue = self.get_issue(match[1])
+        if not issue:
+            return 404, {'errorMessages': ['Issue does not exist']}
+        return 200, dict(issue, self=f'{self.server.url}/rest/api/2/issue/{issue["id"]}')
+
+    def add_comment(self, match, query, payload):
+        issue = self.get_issue(match[1])
+        if not issue:
+            return 404, {'errorMessages': ['Issue does not exist']}
+        comment = {'id': str(len(issue['fields']['comment']['comments']) + 1),
+                   'body': payload['body'],
+                   'author': {'name': 'jirabot', 'displayName': 'Jira Bot'},
+                   'created': datetime.utcnow().strftime(JIRA_TIME_FORMAT)}
+        issue['fields']['comment']['comments'].append(comment)
+        issue['fields']['updated'] = comment['created']
+        return 201, dict(comment, self=f'{self.server.url}/rest/api/2/issue/{issue["id"]}'
+                                       f'/comment/{comment["id"]}')
+
+    def transitions(self, match, query, payload):
+        return 200, {'transitions': [{'id': '2', 'name': 'Close', 'to': {'name': 'Closed'}}]}
+
+    def transition(self, match, query, payload):
+        issue = self.get_issue(match[1])
+        if not issue:
+            return 404, {'errorMessages': ['Issue does not exist']}
+        issue['fields']['status'] = {'name': 'Closed'}
+        issue['fields']['updated'] = datetime.utcnow().strftime(JIRA_TIME_FORMAT)
+        return 204, None
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    '''Accepts the messages without STARTTLS and authentication checks'''
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.stats.add('connection', 0)
+        self.reply('220 localhost ESMTP benchmark')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 OK\r\n')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(line)
+                time.sleep(self.server.latency)
+                self.server.stats.add('message', size)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_servers(estate, latency=0.0, host='127.0.0.1'):
+    '''Starts Commvault, Jira and SMTP servers in background threads on free ports
+
+    Returns {'commvault': server, 'jira': server, 'smtp': server}, each server
+    has stats and address; server.shutdown() stops it.
+    '''
+    servers = {}
+    for name, server_class, handler, prefix in (
+            ('commvault', ThreadingHTTPServer, CommvaultHandler, '/webconsole/api/'),
+            ('jira', ThreadingHTTPServer, JiraHandler, '/'),
+            ('smtp', ThreadingSMTPServer, SMTPHandler, '')):
+        server = server_class((host, 0), handler)
+        server.daemon_threads = True
+        server.estate = estate
+        server.latency = latency
+        server.prefix = prefix
+        server.stats = Stats()
+        server.tokens = set()
+        server.address = f'{host}:{server.server_address[1]}'
+        server.url = f'http://{server.address}'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[name] = server
+    return servers
+
+
+def parse_estate_args(parser):
+    '''Adds the options of the estate and the latency to the parser'''
+    parser.add_argument('--services', type=int, default=2, help='client groups')
+    parser.add_argument('--clients', type=int, default=10, help='clients per group')
+    parser.add_argument('--subclients', type=int, default=3, help='subclients per client')
+    parser.add_argument('--jobs', type=int, default=5, help='jobs per client')
+    parser.add_argument('--comments', type=int, default=5, help='max comments per issue')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds per request')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser
+
+
+def make_estate(args):
+    return Estate(services=args.services, clients=args.clients, subclients=args.subclients,
+                  jobs=args.jobs, comments=args.comments, seed=args.seed)
+
+
+def main():
+    args = parse_estate_args(argparse.ArgumentParser(description=__doc__)).parse_args()
+    servers = start_servers(make_estate(args), latency=args.latency / 1000)
+    for name, server in servers.items():
+        print(f'{name}: {server.address}')
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+'''
+Caches of the Commvault API responses.
+'''
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+def endpoint(path):
+    '''Returns the endpoint of the API path (Client/42 -> Client)'''
+    return re.split('[/?]', path, maxsplit=1)[0]
+
+
+class ResponseCache:
+    '''Thread-safe LRU cache of API responses with TTL per endpoint'''
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.hits = Counter()
+        self.misses = Counter()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.path_locks = defaultdict(threading.Lock)
+
+    def get(self, path, loader):
+        '''Returns the cached response of the path or loads it with loader()'''
+        name = endpoint(path)
+        ttl = self.ttl.get(name)
+        if not ttl:
+            return loader()
+
+        with self.lock:
+            path_lock = self.path_locks[path]
+
+        # concurrent requests of the same path wait for the first one
+        with path_lock:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry and entry[0] > time.monotonic():
+                    self.entries.move_to_end(path)
+                    self.hits[name] += 1
+                    return entry[1]
+                self.misses[name] += 1
+
+            value = loader()
+
+            with self.lock:
+                self.entries[path] = (time.monotonic() + ttl, value)
+                self.entries.move_to_end(path)
+                while len(self.entries) > self.size:
+                    evicted, _ = self.entries.popitem(last=False)
+                    self.path_locks.pop(evicted, None)
+        return value
+
+    def reset_stats(self):
+        '''Resets hits and misses, the responses are kept'''
+        with self.lock:
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self):
+        '''Returns hits and misses per endpoint'''
+        with self.lock:
+            return {name: (self.hits[name], self.misses[name])
+                    for name in sorted(self.hits.keys() | self.misses.keys())}
+
+
+class HTTPCache:
+    '''Persistent SQLite cache of GET responses
+
+    A stored response is returned as is for max_age seconds of its endpoint,
+    after that it is revalidated with ETag/Last-Modified if the server sent
+    them or downloaded again otherwise.
+    '''
+    STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, path, max_age):
+        self.max_age = max_age
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                            'url TEXT PRIMARY KEY, headers TEXT, '
+                            'content BLOB, stored REAL)')
+
+    def request(self, path, url, send):
+        '''Returns the stored response of the url or the one sent by send(headers)'''
+        max_age = self.max_age.get(endpoint(path))
+        if not max_age:
+            return send({})
+
+        with self.lock:
+            row = self.db.execute('SELECT headers, content, stored FROM responses '
+                                  'WHERE url = ?', (url,)).fetchone()
+        if row:
+            headers = json.loads(row[0])
+            if time.time() - row[2] < max_age:
+                with self.lock:
+                    self.hits += 1
+                return self.build_response(url, headers, row[1])
+
+        conditions = {}
+        if row and headers.get('ETag'):
+            conditions['If-None-Match'] = headers['ETag']
+        if row and headers.get('Last-Modified'):
+            conditions['If-Modified-Since'] = headers['Last-Modified']
+
+        response = send(conditions)
+        if row and conditions and response.status_code == 304:
+            with self.lock, self.db:
+                self.revalidations += 1
+                self.db.execute('UPDATE responses SET stored = ? WHERE url = ?',
+                                (time.time(), url))
+            return self.build_response(url, headers, row[1])
+
+        with self.lock:
+            self.misses += 1
+        if response.status_code == 200:
+            headers = {name: response.headers[name]
+                       for name in self.STORED_HEADERS if name in response.headers}
+            with self.lock, self.db:
+                self.db.execute('REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                (url, json.dumps(headers), response.content, time.time()))
+        return response
+
+    def build_response(self, url, headers, content):
+        '''Makes a Response instance from the stored data'''
+        response = Response()
+        response.url = url
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        return response
+
+    def close(self):
+        '''Closes the database'''
+        with self.lock:
+            self.db.close()
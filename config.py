@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
+'''
+Settings, templates and notifiers of the scripts.
+
+They are resolved on first access (config.SETTINGS, config.SOX_TEMPLATE, ...),
+so a script pays only for what it uses. The compiled templates are cached
+in STATE_DIR and reused by the next runs.
+'''
 import os
+import sys
+import html
 import urllib3
+import threading
 from pathlib import Path
 from functools import partial
+from contextlib import contextmanager
 
 import yaml
 from dotenv import load_dotenv
-from jinja2 import Template
 from loguru import logger
-from notifiers import get_notifier
-from notifiers.logging import NotificationHandler
 
 
 load_dotenv()
@@ -22,43 +30,198 @@ BASE_DIR = Path(__file__).parent
 LOG_DIR = BASE_DIR / 'logs'
 LOG_DIR.mkdir(exist_ok=True)
 
+STATE_DIR = BASE_DIR / 'state'
+STATE_DIR.mkdir(exist_ok=True)
+
+# the script run by the scheduler, its logs are written only to its own file
+RUNNING_SCRIPT = None
+
 SETTINGS_FILE = BASE_DIR / 'settings.yml'
-SETTINGS = yaml.safe_load(SETTINGS_FILE.open())
 
-SOX_TEMPLATE_FILE = BASE_DIR / 'templates' / 'sox.html.j2'
-SOX_TEMPLATE = Template(SOX_TEMPLATE_FILE.read_text(encoding='utf8'))
+TEMPLATE_DIR = BASE_DIR / 'templates'
+TEMPLATE_CACHE_DIR = STATE_DIR / 'templates'
 
-SYSINFR_TEMPLATE_FILE = BASE_DIR / 'templates' / 'sysinfr.html.j2'
-SYSINFR_TEMPLATE = Template(SOX_TEMPLATE_FILE.read_text(encoding='utf8'))
+SOX_TEMPLATE_FILE = TEMPLATE_DIR / 'sox.html.j2'
+SYSINFR_TEMPLATE_FILE = TEMPLATE_DIR / 'sysinfr.html.j2'
 
-JIRA = {
-    'server': SETTINGS['jira'],
-    'basic_auth': (os.getenv('JIRA_USERNAME'), os.getenv('JIRA_PASSWORD')),
-    'options': {'verify': False},
-}
+# the lazy attributes inside this module are read through it
+this = sys.modules[__name__]
 
-COMMVAULT = {
-    'webconsole_hostname': SETTINGS['commvault']['api'],
-    'commcell_username': os.getenv('COMMVAULT_USERNAME'),
-    'commcell_password': os.getenv('COMMVAULT_PASSWORD'),
-}
 
-SMTP_PARAMS = {
-    'from': SETTINGS['smtp']['from'],
-    'to': SETTINGS['smtp']['to'],
-    'subject': 'Commvault | Automation scripts',
-    'host': SETTINGS['smtp']['host'],
-    'port': SETTINGS['smtp']['port'],
-    'tls': SETTINGS['smtp']['tls'],
-    'username': os.getenv('SMTP_USERNAME'),
-    'password': os.getenv('SMTP_PASSWORD'),
-    'html': SETTINGS['smtp']['html'],
+def load_settings():
+    with SETTINGS_FILE.open() as file:
+        return yaml.safe_load(file)
+
+
+def get_template(name):
+    '''Returns the template from TEMPLATE_DIR, it's compiled once and cached on disk'''
+    return get_environment().get_template(name)
+
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+        TEMPLATE_CACHE_DIR.mkdir(exist_ok=True)
+        _environment = Environment(
+            loader=FileSystemLoader(str(TEMPLATE_DIR)),
+            bytecode_cache=FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR)),
+        )
+    return _environment
+
+
+_environment = None
+
+
+def get_jira_params():
+    return {
+        'server': this.SETTINGS['jira'],
+        'basic_auth': (os.getenv('JIRA_USERNAME'), os.getenv('JIRA_PASSWORD')),
+        'options': {'verify': False},
+    }
+
+
+def get_commvault_params():
+    return {
+        'webconsole_hostname': this.SETTINGS['commvault']['api'],
+        'commcell_username': os.getenv('COMMVAULT_USERNAME'),
+        'commcell_password': os.getenv('COMMVAULT_PASSWORD'),
+    }
+
+
+def get_smtp_params():
+    return {
+        'from': this.SETTINGS['smtp']['from'],
+        'to': this.SETTINGS['smtp']['to'],
+        'subject': 'Commvault | Automation scripts',
+        'host': this.SETTINGS['smtp']['host'],
+        'port': this.SETTINGS['smtp']['port'],
+        'tls': this.SETTINGS['smtp']['tls'],
+        'username': os.getenv('SMTP_USERNAME'),
+        'password': os.getenv('SMTP_PASSWORD'),
+        'html': this.SETTINGS['smtp']['html'],
+    }
+
+
+def get_email():
+    from notifiers import get_notifier
+
+    email = get_notifier('email')
+    email.notify = partial(email.notify, **this.SMTP_PARAMS)
+    return email
+
+
+# module attributes which are resolved on first access
+LAZY_ATTRIBUTES = {
+    'SETTINGS': load_settings,
+    'SOX_TEMPLATE': lambda: get_template(SOX_TEMPLATE_FILE.name),
+    'SYSINFR_TEMPLATE': lambda: get_template(SYSINFR_TEMPLATE_FILE.name),
+    'JIRA': get_jira_params,
+    'COMMVAULT': get_commvault_params,
+    'SMTP_PARAMS': get_smtp_params,
+    'email': get_email,
 }
 
-email = get_notifier('email')
-email.notify = partial(email.notify, **SMTP_PARAMS)
+
+def __getattr__(name):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = LAZY_ATTRIBUTES[name]()
+    return value
+
+
+class ErrorDigest:
+    '''Collects the errors and emails them by one digest per interval
+
+    Identical errors are counted instead of being repeated. The logging thread
+    only stores the error, the email is sent by the background thread
+    and the rest of the errors by stop() at the end of the run.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.errors = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def write(self, message):
+        record = message.record
+        key = (record['name'], record['line'], record['message'])
+        with self.lock:
+            if key in self.errors:
+                self.errors[key]['count'] += 1
+                self.errors[key]['last'] = record['time']
+            else:
+                self.errors[key] = {'text': str(message), 'count': 1, 'last': record['time']}
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='error-digest',
+                                               daemon=True)
+                self.thread.start()
+
+    def run(self):
+        interval = this.SETTINGS['logging'].get('email_interval', 300)
+        while not self.stopped.wait(interval):
+            self.send()
+
+    def send(self):
+        '''Emails the collected errors at once'''
+        with self.lock:
+            errors, self.errors = self.errors, {}
+        if not errors:
+            return
+
+        digest = []
+        for error in errors.values():
+            digest.append(error['text'].rstrip('\n'))
+            if error['count'] > 1:
+                digest.append(f'(repeated {error["count"]} times, '
+                              f'the last one at {error["last"]:%Y-%m-%d %H:%M:%S})')
+        message = '\n'.join(digest)
+        if this.SMTP_PARAMS['html']:
+            message = f'<pre>{html.escape(message)}</pre>'
+
+        count = sum(error['count'] for error in errors.values())
+        try:
+            this.email.notify(message=message,
+                              subject=f'{this.SMTP_PARAMS["subject"]} | errors: {count}')
+        except Exception as error:
+            # the error can't be logged, it would be sent by this sink again
+            print(f'the errors have not been emailed: {error}', file=sys.stderr)
+
+    def stop(self):
+        '''Sends the rest of the errors, loguru calls it when the sink is removed'''
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.send()
+
 
 logger.remove()
-logger.add(sink=NotificationHandler('email', defaults=SMTP_PARAMS),
-           format=SETTINGS['logging']['format'],
+logger.add(sink=ErrorDigest(),
+           format=lambda record: this.SETTINGS['logging']['format'] + '\n{exception}',
            level='ERROR')
+
+
+@contextmanager
+def atomic_open(path, permissions=0o666):
+    '''Opens the temporary file for writing which replaces the file if no exception is raised
+
+    So the readers never see a partial file, and a broken run leaves the previous one.
+    '''
+    tmp_file = path.with_name(path.name + '.tmp')
+    # a file left by a killed process would keep its permissions
+    tmp_file.unlink(missing_ok=True)
+    try:
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, permissions)
+        with os.fdopen(fd, 'w', encoding='utf8') as file:
+            yield file
+        tmp_file.replace(path)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def log_filter(script):
+    '''Passes the records to the script's log file unless another script is running'''
+    return lambda record: RUNNING_SCRIPT in (None, script)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+Job queries to the Commvault API and the processing of their records.
+'''
+from config import logger
+
+
+# the fields of the job summary which are kept (with their default values)
+JOB_FIELDS = {
+    'jobId': None,
+    'status': '',
+    'totalFailedFiles': 0,
+    'totalFailedFolders': 0,
+    'appTypeName': '',
+    'percentComplete': 0,
+    'pendingReason': '',
+}
+
+# the statuses of the jobs which won't change anymore
+FINAL_STATUSES = (
+    'Completed',
+    'Completed w/ one or more errors',
+    'Completed w/ one or more warnings',
+    'Failed',
+    'Failed to Start',
+    'Killed',
+    'Committed',
+    'Not Found',
+)
+
+
+def iter_jobs(commvault, client_ids, lookup_time, page_size):
+    '''Yields slim records of the clients' jobs for lookup_time hours page by page
+
+    Only one page of full job summaries is held in memory at once.
+    '''
+    request_json = {
+        'scope': 1,
+        'category': 0,
+        'pagingConfig': {
+            'sortDirection': 1,
+            'offset': 0,
+            'sortField': 'jobId',
+            'limit': page_size,
+        },
+        'jobFilter': {
+            'completedJobLookupTime': int(lookup_time * 60 * 60),
+            'showAgedJobs': False,
+            'clientList': [{'clientId': client_id} for client_id in client_ids],
+            'jobTypeList': [],
+        },
+    }
+
+    while True:
+        resp_json = commvault.get_jobs(request_json)
+        jobs = resp_json.get('jobs', [])
+        for job in jobs:
+            if 'jobSummary' in job and job['jobSummary']['isVisible'] is True:
+                yield slim_job(job['jobSummary'])
+
+        request_json['pagingConfig']['offset'] += page_size
+        # the total is trusted only if it is given, otherwise the jobs are
+        # paged until a page isn't full
+        total = resp_json.get('totalRecordsWithoutPaging')
+        if (len(jobs) < page_size or
+                (total is not None and request_json['pagingConfig']['offset'] >= total)):
+            break
+
+
+def slim_job(summary):
+    '''Keeps only JOB_FIELDS and the client name of the job summary'''
+    job = {field: summary.get(field, default) for field, default in JOB_FIELDS.items()}
+    job['clientName'] = summary['subclient']['clientName']
+    return job
+
+
+def is_clean(job):
+    '''Checks if the job completed without any failed items
+
+    Virtual Server jobs are considered clean even with failed items.
+    '''
+    return (job['status'].lower() == 'completed' and (
+        not (job['totalFailedFiles'] or job['totalFailedFolders']) or
+        job['appTypeName'] == 'Virtual Server'))
+
+
+def partition_jobs(jobs, clients, vm_index):
+    '''Groups the job records by clients: {client_name: {job_id: job}}
+
+    Virtual Server jobs belong to the hypervisor's client, so they are also given
+    to the clients whose VMs they have backed up, vm_index(job) returns
+    VMIndex of the job.
+    '''
+    names = {client_name.lower(): client_name for client_name in clients}
+    partitions = {}
+    for job in jobs:
+        client_name = job['clientName'].lower()
+        owners = [client_name] if client_name in names else []
+
+        if job['appTypeName'] == 'Virtual Server':
+            index = vm_index(job)
+            owners.extend(name for name, original_name in names.items()
+                          if name != client_name and
+                          index.find(vm_name(original_name)) is not None)
+            if not owners:
+                logger.error(f'clients of the Virtual Server job ({job["jobId"]}) '
+                             f'are not found, status: {job["status"]}')
+
+        for owner in owners:
+            partitions.setdefault(owner, {})[job['jobId']] = job
+    return partitions
+
+
+def vm_name(client_name):
+    '''Returns the name of the client's VM
+
+    After restoring VM with new name, Commvault renames old client name
+    For example, src: srv-tibload-001, dest: srv-tibload-001_20102020
+    '''
+    return client_name.split('_')[0]
+
+
+class VMIndex:
+    '''Index of the VMs backed up by a Virtual Server job by their names'''
+
+    def __init__(self, vms):
+        # a restored VM is also found by its original name (see vm_name),
+        # if several VMs match, the first one in the job's list of VMs wins
+        self.reasons = {}
+        for vm in vms:
+            reason = vm.get('FailureReason', '')
+            self.reasons.setdefault(vm['vmName'], reason)
+            self.reasons.setdefault(vm_name(vm['vmName']), reason)
+
+    def find(self, name):
+        '''Returns the failure reason of the VM with the whole name or None'''
+        return self.reasons.get(name)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+Batch delivery of the rendered emails over a few reused SMTP connections.
+
+Each connection is opened, secured by STARTTLS and authenticated once,
+then it sends the messages one by one. A message which has failed with
+a temporary error (4xx reply, broken connection) is retried over a new
+connection, the permanent errors (5xx replies) and the refused recipients
+aren't retried.
+'''
+import time
+import smtplib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import formatdate
+
+import config
+
+
+SMTP_TIMEOUT = 30
+# attempts to send one message and seconds between them (multiplied by the attempt)
+MESSAGE_ATTEMPTS = 3
+RETRY_DELAY = 2
+
+
+class Mailer:
+    '''SMTP connection which is opened by the first message and reused by the next ones'''
+
+    def __init__(self, params):
+        self.params = params
+        self.smtp = None
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.params['host'], self.params['port'], timeout=SMTP_TIMEOUT)
+        if self.params['tls']:
+            smtp.starttls()
+        if self.params.get('username'):
+            smtp.login(self.params['username'], self.params['password'])
+        self.smtp = smtp
+
+    def send(self, message):
+        '''Sends the message {'subject', 'to', 'body'}, returns {recipient: error or None}'''
+        email = make_email(self.params, message)
+        for attempt in range(1, MESSAGE_ATTEMPTS + 1):
+            try:
+                if self.smtp is None:
+                    self.connect()
+                refused = self.smtp.send_message(email, to_addrs=message['to'])
+                break
+            except smtplib.SMTPRecipientsRefused as error:
+                refused = error.recipients
+                break
+            except (smtplib.SMTPException, OSError) as error:
+                # the connection can be broken, the next attempt opens a new one
+                self.close()
+                if attempt == MESSAGE_ATTEMPTS or not is_transient(error):
+                    if isinstance(error, smtplib.SMTPResponseException):
+                        error = format_reply(error.smtp_code, error.smtp_error)
+                    return {recipient: str(error) for recipient in message['to']}
+                time.sleep(RETRY_DELAY * attempt)
+
+        return {recipient: format_reply(*refused[recipient]) if recipient in refused else None
+                for recipient in message['to']}
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+
+def send_messages(messages, connections=1, params=None):
+    '''Sends the messages over the given number of SMTP connections at once
+
+    Returns the results in the order of the messages: [{recipient: error or None}].
+    '''
+    params = params or config.SMTP_PARAMS
+    results = [None] * len(messages)
+    # the connections take the next message as soon as they are free
+    queue = deque(enumerate(messages))
+
+    def deliver():
+        mailer = Mailer(params)
+        try:
+            while True:
+                try:
+                    index, message = queue.popleft()
+                except IndexError:
+                    return
+                results[index] = mailer.send(message)
+        finally:
+            mailer.close()
+
+    with ThreadPoolExecutor(connections) as pool:
+        deliveries = [pool.submit(deliver) for _ in range(min(connections, len(messages)))]
+    for delivery in deliveries:
+        delivery.result()
+    return results
+
+
+def is_transient(error):
+    '''Checks if the SMTP error is temporary: a 4xx reply or a broken connection'''
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500
+    # SMTPException is a subclass of OSError, but its other errors are permanent
+    # (STARTTLS isn't supported, no suitable authentication method, ...)
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    return isinstance(error, OSError)
+
+
+def make_email(params, message):
+    email = EmailMessage()
+    email['To'] = ', '.join(message['to'])
+    email['From'] = params['from']
+    email['Subject'] = message['subject']
+    email['Date'] = formatdate(localtime=True)
+    email.add_alternative(message['body'], subtype='html' if params['html'] else 'plain')
+    return email
+
+
+def format_reply(code, reply):
+    return f'{code} {reply.decode(errors="replace") if isinstance(reply, bytes) else reply}'
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''
+Statistics of the API requests grouped by endpoints (for example, GET Subclient/{id}).
+
+The sessions are instrumented by instrument_session(), and report() logs
+the summary at the end of the script's run and writes it into the files
+of the section metrics.
+'''
+import re
+import json
+import math
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import config
+from config import logger
+
+
+METRICS_DIR = config.BASE_DIR / config.SETTINGS.get('metrics', {}).get('directory', 'metrics')
+METRICS_FORMATS = config.SETTINGS.get('metrics', {}).get('formats', [])
+
+PERCENTILES = [50, 95, 99]
+
+
+class RequestMetrics:
+    '''Thread-safe counters and latencies of the requests by endpoints'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0,
+                                              'bytes': 0, 'latencies': []})
+
+    def record(self, endpoint, seconds, size, retries=0, error=False):
+        '''Adds the request to the endpoint's statistics'''
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['retries'] += retries
+            stats['bytes'] += size
+            stats['latencies'].append(seconds)
+
+    def hook(self, response, *args, **kwargs):
+        '''The response hook of requests which records the response'''
+        if kwargs.get('stream'):
+            size = int(response.headers.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+
+        # urllib3 keeps the retries of the request in the history of its Retry
+        retries = getattr(response.raw, 'retries', None)
+        self.record(endpoint_template(response.request.method, response.url),
+                    response.elapsed.total_seconds(),
+                    size,
+                    retries=len(retries.history) if retries else 0,
+                    error=not response.ok)
+
+    def summary(self):
+        '''Returns the statistics of the endpoints sorted by the total time
+
+        {endpoint: {'calls', 'errors', 'retries', 'bytes', 'seconds', 'p50', 'p95', 'p99', 'max'}}
+        '''
+        with self.lock:
+            endpoints = {endpoint: dict(stats) for endpoint, stats in self.endpoints.items()}
+
+        summary = {}
+        for endpoint, stats in sorted(endpoints.items(),
+                                      key=lambda item: -sum(item[1]['latencies'])):
+            latencies = sorted(stats.pop('latencies'))
+            stats['seconds'] = sum(latencies)
+            for value in PERCENTILES:
+                stats[f'p{value}'] = percentile(latencies, value)
+            stats['max'] = latencies[-1]
+            summary[endpoint] = stats
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+REQUESTS = RequestMetrics()
+
+
+def endpoint_template(method, url):
+    '''Returns the method and the path without IDs: GET Subclient/{id}, POST rest/api/2/issue/{key}/comment'''
+    path = urlsplit(url).path.split('/webconsole/api/', 1)[-1].strip('/')
+    path = re.sub(r'(?<!/api)/\d+(?=/|$)', '/{id}', path)
+    path = re.sub(r'/[A-Z][A-Z0-9]*-\d+(?=/|$)', '/{key}', path)
+    return f'{method} {path}'
+
+
+def percentile(values, percent):
+    '''Returns the percentile of the sorted values by the nearest-rank method'''
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def instrument_session(session):
+    '''Records the requests of the requests.Session (Jira, Commvault)'''
+    session.hooks['response'].append(REQUESTS.hook)
+    return session
+
+
+def report(script):
+    '''Logs the summary of the run's requests and writes it into METRICS_FORMATS files
+
+    The statistics are reset for the next run.
+    '''
+    summary = REQUESTS.summary()
+    REQUESTS.reset()
+    if not summary:
+        return
+
+    logger.info(f'{"endpoint":<48} {"calls":>6} {"errors":>6} {"retries":>7} '
+                f'{"KiB":>8} {"total s":>8} {"p50 ms":>7} {"p95 ms":>7} {"p99 ms":>7} '
+                f'{"max ms":>7}')
+    for endpoint, stats in summary.items():
+        logger.info(f'{endpoint:<48} {stats["calls"]:>6} {stats["errors"]:>6} '
+                    f'{stats["retries"]:>7} {stats["bytes"] / 1024:>8.1f} '
+                    f'{stats["seconds"]:>8.2f} {stats["p50"] * 1000:>7.0f} '
+                    f'{stats["p95"] * 1000:>7.0f} {stats["p99"] * 1000:>7.0f} '
+                    f'{stats["max"] * 1000:>7.0f}')
+
+    if 'json' in METRICS_FORMATS:
+        write_file(METRICS_DIR / f'{script}.json', json.dumps(summary, indent=2))
+    if 'prometheus' in METRICS_FORMATS:
+        write_file(METRICS_DIR / f'{script}.prom', to_prometheus(script, summary))
+
+
+def to_prometheus(script, summary):
+    '''Returns the summary in the text format of Prometheus (node_exporter textfile)'''
+    lines = []
+    metrics = [
+        ('requests_total', 'counter', 'API requests', 'calls'),
+        ('request_errors_total', 'counter', 'API requests with 4xx/5xx responses', 'errors'),
+        ('request_retries_total', 'counter', 'retries of the API requests', 'retries'),
+        ('response_bytes_total', 'counter', 'bytes received from the API', 'bytes'),
+    ]
+    for name, metric_type, description, field in metrics:
+        lines.append(f'# HELP commvault_scripts_{name} {description}')
+        lines.append(f'# TYPE commvault_scripts_{name} {metric_type}')
+        for endpoint, stats in summary.items():
+            lines.append(f'commvault_scripts_{name}{{{labels(script, endpoint)}}} '
+                         f'{stats[field]}')
+
+    lines.append('# HELP commvault_scripts_request_seconds latency of the API requests')
+    lines.append('# TYPE commvault_scripts_request_seconds summary')
+    for endpoint, stats in summary.items():
+        for value in PERCENTILES:
+            lines.append(f'commvault_scripts_request_seconds{{{labels(script, endpoint)},'
+                         f'quantile="{value / 100}"}} {stats[f"p{value}"]:.6f}')
+        lines.append(f'commvault_scripts_request_seconds_sum{{{labels(script, endpoint)}}} '
+                     f'{stats["seconds"]:.6f}')
+        lines.append(f'commvault_scripts_request_seconds_count{{{labels(script, endpoint)}}} '
+                     f'{stats["calls"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def labels(script, endpoint):
+    method, path = endpoint.split(' ', 1)
+    return f'script="{script}",method="{method}",endpoint="{path}"'
+
+
+def write_file(path, content):
+    '''Replaces the file atomically, so the collector never reads a partial one'''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with config.atomic_open(path) as file:
+        file.write(content)
+    logger.info(f'{path} is created')
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+It runs the scripts on schedules (section scheduler) in one long-running process.
+
+The scripts share warm Commvault and Jira sessions and keep their caches
+between the runs, so the start, import and login costs are paid once.
+The cached responses expire by the TTLs of their endpoints.
+'''
+import time
+import inspect
+import importlib
+from datetime import datetime, timedelta
+
+import config
+from config import logger
+from sessions import commvault_login, jira_login
+
+
+logger.add(sink=config.LOG_DIR / 'scheduler.log',
+           rotation=config.SETTINGS['logging']['rotation'],
+           format=config.SETTINGS['logging']['format'],
+           level='INFO',
+           filter=config.log_filter('scheduler'))
+
+
+class Task:
+    '''The script's main() which is run every N minutes and/or at HH:MM'''
+
+    def __init__(self, script, every=None, at=(), args=None):
+        self.script = script
+        self.module = importlib.import_module(script)
+        self.every = every
+        self.at = [datetime.strptime(item, '%H:%M').time() for item in at]
+        self.args = args or {}
+
+        now = datetime.now()
+        self.next_run = now if every else self.get_next_run(now)
+
+    def get_next_run(self, now):
+        '''Returns the time of the next run after now'''
+        runs = []
+        for at in self.at:
+            run = datetime.combine(now.date(), at)
+            runs.append(run if run > now else run + timedelta(days=1))
+        if self.every:
+            runs.append(now + timedelta(minutes=self.every))
+        return min(runs)
+
+    def run(self, sessions):
+        '''Run the script's main() with the shared sessions it accepts'''
+        logger.info(f'{self.script} is started')
+        started = time.monotonic()
+
+        kwargs = dict(self.args)
+        parameters = inspect.signature(self.module.main).parameters
+        if 'jira' in parameters:
+            kwargs['jira'] = sessions.get_jira()
+        if 'commvault' in parameters:
+            kwargs['commvault'] = sessions.get_commvault()
+        if 'session' in parameters:
+            kwargs['session'] = sessions.get_rest(self.module)
+
+        config.RUNNING_SCRIPT = self.script
+        try:
+            self.module.main(**kwargs)
+        finally:
+            config.RUNNING_SCRIPT = 'scheduler'
+
+        logger.info(f'{self.script} is finished in {time.monotonic() - started:.1f} seconds')
+
+
+class Sessions:
+    '''Commvault and Jira sessions which are created once and shared by the tasks'''
+
+    def __init__(self):
+        self.jira = None
+        self.commvault = None
+        self.rest = None
+        self.rest_module = None
+
+    def get_jira(self):
+        '''Returns the Jira session'''
+        if not self.jira:
+            self.jira = jira_login()
+            logger.info('Jira session is created')
+        return self.jira
+
+    def get_commvault(self):
+        '''Returns the lean Commvault client, it renews its token on 401'''
+        if not self.commvault:
+            self.commvault = commvault_login()
+            logger.info('Commvault client is created')
+        return self.commvault
+
+    def get_rest(self, module):
+        '''Returns the REST session of service-details, query_api renews its token on 401'''
+        if not self.rest:
+            self.rest = module.commvault_login()
+            self.rest_module = module
+            logger.info('Commvault session is created')
+        return self.rest
+
+    def close(self):
+        '''Close all created sessions'''
+        if self.jira:
+            self.jira.close()
+        if self.commvault:
+            self.commvault.close()
+        if self.rest:
+            self.rest_module.commvault_logout(self.rest)
+        logger.info('sessions are closed')
+
+
+@logger.catch
+def main():
+    config.RUNNING_SCRIPT = 'scheduler'
+    tasks = [Task(**item) for item in config.SETTINGS['scheduler']]
+    logger.info(f'tasks: {[task.script for task in tasks]}')
+
+    sessions = Sessions()
+    try:
+        while True:
+            task = min(tasks, key=lambda task: task.next_run)
+            delay = (task.next_run - datetime.now()).total_seconds()
+            if delay > 0:
+                time.sleep(delay)
+
+            # a failed task mustn't stop the scheduler
+            with logger.catch():
+                task.run(sessions)
+            task.next_run = task.get_next_run(datetime.now())
+    except KeyboardInterrupt:
+        logger.info('scheduler is stopped')
+    finally:
+        sessions.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,37 +3,70 @@
 Takes clients from chosen Client Group and create a high-level view of the clients' settings.
 '''
 import re
-import socket
+import sys
+import json
+import time
+import hashlib
 from datetime import datetime
-from base64 import b64encode
 from configparser import ConfigParser
-from collections import defaultdict
-from json.decoder import JSONDecodeError
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from loguru import logger
-from jinja2 import Template
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib.parse import urljoin
-from urllib3.util.retry import Retry
 
 import config
+from api import create_session, send_request
+from cache import HTTPCache, ResponseCache
+from jobs import FINAL_STATUSES
+from metrics import report
 
 
+logger.add(sink=config.LOG_DIR / 'service-details.log',
+           rotation=config.SETTINGS['logging']['rotation'],
+           format=config.SETTINGS['logging']['format'],
+           level='INFO',
+           filter=config.log_filter('service-details'))
+
 CONFIG_FILE = config.BASE_DIR / 'services.ini'
 
-TEMPLATE_FILE = config.BASE_DIR / 'templates' / 'service.yml.j2'
-TEMPLATE = Template(TEMPLATE_FILE.read_text(encoding='utf8'))
+TEMPLATE_FILE = config.TEMPLATE_DIR / 'service.yml.j2'
 
 REPORTS_DIR = config.BASE_DIR / 'reports'
 REPORTS_DIR.mkdir(exist_ok=True)
 
-REQUEST_TIMEOUT = 30
-RETRY_STRATEGY = Retry(
-    total=3,
-    backoff_factor=2,
-    status_forcelist=[429, 500, 502, 503, 504]
-)
+# fingerprints and details of the clients from the previous run
+STATE_DIR = config.STATE_DIR / 'service-details'
+STATE_DIR.mkdir(exist_ok=True)
+# hours after which the details aren't reused and all clients are crawled again,
+# so the changes which aren't fingerprinted (schedules, retention) are picked up
+STATE_MAX_AGE = config.SETTINGS['commvault'].get('state_max_age', 24)
+
+# the number of clients (and subclients) which are crawled concurrently
+WORKERS = config.SETTINGS['commvault'].get('workers', 1)
+# the maximum number of requests per second to the one host (0 - unlimited)
+RATE_LIMIT = config.SETTINGS['commvault'].get('rate_limit', 0)
+# the listed properties of the subclients and the client's jobs are used
+# instead of requesting them once per subclient
+BULK_REQUESTS = config.SETTINGS['commvault'].get('bulk_requests', False)
+# hours of the client's jobs which are requested at once (see BULK_REQUESTS)
+JOBS_LOOKUP_TIME = config.SETTINGS['commvault']['lookup_time']
+
+# seconds to reuse GET responses for (the endpoints not listed aren't cached)
+CACHE_TTL = {
+    'Client': 3600,
+    'StoragePolicy': 3600,
+}
+CACHE_SIZE = 1024
+CACHE = ResponseCache(CACHE_TTL, CACHE_SIZE)
+
+# the responses are kept between runs if the persistent cache is enabled
+HTTP_CACHE_FILE = config.BASE_DIR / 'http_cache.sqlite'
+HTTP_CACHE = config.SETTINGS.get('http_cache', {})
+
+# the format of the last job's datetimes in the report
+DATETIME_FORMAT = '%H:%M:%S %d.%m.%Y'
 
 BACKUP_LEVEL = {
     4: 'SynFull',
@@ -43,238 +76,403 @@ BACKUP_LEVEL = {
 }
 
 
-class BaseUrlSession(Session):
-    '''A Session with a URL that all requests will use as a base'''
-
-    def __init__(self, base_url):
-        self.base_url = base_url
-        Session.__init__(self)
-
-    def request(self, method, url, *args, **kwargs):
-        '''Send the request after generating the complete URL'''
-        url = self.create_url(url)
-        return Session.request(self, method, url, *args, **kwargs)
-
-    def create_url(self, url):
-        '''Create the URL based off the partial path'''
-        return urljoin(self.base_url, url)
-
-
-class TimeoutHTTPAdapter(HTTPAdapter):
-    '''HTTPAdapter with a default timeout'''
-
-    def __init__(self, *args, **kwargs):
-        self.timeout = kwargs.pop('timeout', REQUEST_TIMEOUT)
-        HTTPAdapter.__init__(self, *args, **kwargs)
-
-    def send(self, request, **kwargs):
-        kwargs['timeout'] = kwargs.get('timeout', self.timeout)
-        return HTTPAdapter.send(self, request, **kwargs)
-
-
 @logger.catch
-def main():
-    session = commvault_login()
-    logger.info('Commvault session is created')
-
-    resp_json = query_api(session, 'GET', 'ClientGroup')
-    client_groups = {item['name']: item['Id'] for item in resp_json['groups']}
-    logger.info(f'client groups: {len(client_groups)}')
-
-    for service_name in get_services_from_file():
-        logger.info(f'service: {service_name}')
-        client_group_id = client_groups[service_name]
-
-        resp_json = query_api(session, 'GET', f'ClientGroup/{client_group_id}')
-        clients = [(item['clientId'], item['clientName'])
-                   for item in resp_json['clientGroupDetail']['associatedClients']]
-        logger.info(f'clients: {clients}')
-
-        servers = []
-        for client_id, client_name in clients:
-            logger.info(f'client: {client_name}')
-            resp_json = query_api(session, 'GET', f'Subclient/?clientId={client_id}')
-            subclients = []
-            for node in resp_json.get('subClientProperties', []):
-                subclients.append(node['subClientEntity'])
-
-            resp_json = query_api(session, 'GET', f'Client/{client_id}')
-            client_props = resp_json['clientProperties'][0]
-            operating_system = client_props['client']['osInfo']['OsDisplayInfo']['OSName']
-
-            virtual_machine = client_props.get('vmStatusInfo')
-            if virtual_machine and virtual_machine.get('subclientName'):
-                subclients.append(virtual_machine['vsaSubClientEntity'])
-            logger.info(f'subclients: {len(subclients)}')
-
-            agents = defaultdict(list)
-            for node in subclients:
-                subclient_id = node['subclientId']
-                subclient_name = node['subclientName']
-                logger.info(f'subclient: {subclient_name}')
-
-                agent = node['appName']
-                if agent in ('Oracle', 'SQL Server', 'MySQL'):
-                    backupset = None
-                    instance = node['instanceName']
-                else:
-                    backupset = node['backupsetName']
-                    instance = None
-
-                resp_json = query_api(session, 'GET', f'Subclient/{subclient_id}')
-                subclient_props = resp_json['subClientProperties'][0]
-                subclient_status = subclient_props['commonProperties']['enableBackup']
-
-                last_job = {}
-                job_info = subclient_props['commonProperties'].get('lastBackupJobInfo')
-                if job_info and job_info.get('jobID'):
-                    job_id = job_info['jobID']
-                    resp_json = query_api(session, 'GET', f'Job/{job_id}')
-
-                    try:
-                        job_summary = resp_json['jobs'][0]['jobSummary']
-                    except KeyError:
-                        job_summary = {'status': 'Not Found',
-                                       'jobStartTime': None,
-                                       'jobEndTime': None}
-
-                    last_job['id'] = job_id
-                    last_job['status'] = job_summary['status']
-                    last_job['started'] = timestamp_to_datetime(job_summary['jobStartTime'])
-                    last_job['finished'] = timestamp_to_datetime(job_summary['jobEndTime'])
-
-                content = defaultdict(list)
-                if node['appName'] == 'File System':
-                    for item in subclient_props['content']:
-                        include = item.get('path') or item.get('includePath')
-                        if include:
-                            content['include'].append(include)
-                        else:
-                            content['exclude'].append(item['excludePath'])
-
-                resp_json = None
-                backup_storage_policy = subclient_props['commonProperties']['storageDevice']['dataBackupStoragePolicy']
-                if backup_storage_policy.get('storagePolicyId'):
-                    policy_id = backup_storage_policy['storagePolicyId']
-                    resp_json = query_api(session, 'GET', f'StoragePolicy/{policy_id}')
-
-                storage_policy = {}
-                if resp_json and resp_json.get('copy'):
-                    retention = resp_json['copy'][0]['retentionRules']
-                    retain_days = retention['retainBackupDataForDays']
-                    retain_cycles = retention['retainBackupDataForCycles']
-                    storage_policy['name'] = backup_storage_policy.get('storagePolicyName')
-                    storage_policy['retention'] = f'{retain_days} days, {retain_cycles} cycles'
-
-                resp_json = query_api(session, 'GET', f'Schedules/?subclientId={subclient_id}')
-
-                schedules = []
-                if resp_json:
-                    task = resp_json['taskDetail'][0]
-                    for sub_task in task['subTasks']:
-                        level = BACKUP_LEVEL[sub_task['options']['backupOpts']['backupLevel']]
-                        description = sub_task['pattern']['description'].strip()
-                        description = re.sub(' starting .+?and', 'and', description)
-                        schedules.append({'type': level, 'pattern': description})
-
-                agents[agent].append({
-                    'name': subclient_name,
-                    'backupset': backupset,
-                    'instance': instance,
-                    'status': subclient_status,
-                    'content': content,
-                    'storage_policy': storage_policy,
-                    'schedules': schedules,
-                    'last_job': last_job,
-                })
-
-            # before: agents = {'agent_1': [subclients], ...}
-            # after:  agents = {'agent_1': {'backupsets': [subclients]}, ...}
-            for agent_name in agents:
-                if agents[agent_name][0]['backupset']:
-                    agents[agent_name] = {'backupsets': agents[agent_name]}
-                else:
-                    agents[agent_name] = {'instances': agents[agent_name]}
-
-            # before: agents = {'agent_1': {'backupsets': [subclients]}, ...}
-            # after:  agents = {'agent_1': {'backupsets': {'backupset_1': [subclients], ...}}, ...}
-            for agent_name in agents:
-                if agents[agent_name].get('backupsets'):
-                    tmp = defaultdict(list)
-                    for subclient in agents[agent_name]['backupsets']:
-                        tmp[subclient['backupset']].append(subclient)
-                    agents[agent_name]['backupsets'] = tmp
-                else:
-                    tmp = defaultdict(list)
-                    for subclient in agents[agent_name]['instances']:
-                        tmp[subclient['instance']].append(subclient)
-                    agents[agent_name]['instances'] = tmp
-
-            servers.append({
-                'hostname': client_name,
-                'os': operating_system,
-                'agents': agents,
-            })
-
-        current_time = datetime.now()
-
-        report_file = REPORTS_DIR / f'{service_name}_{current_time.strftime("%Y%m%d%H%M")}.yml'
-        report_file.write_text(TEMPLATE.render(current_time=current_time,
-                                               service_name=service_name,
-                                               servers=servers),
-                               encoding='utf8')
-        logger.info(f'{report_file} is created')
-    commvault_logout(session)
-    logger.info('Commvault session is closed')
+def main(incremental=False, export=False, session=None):
+    # the responses are kept between the scheduler's runs until their TTLs expire,
+    # the statistics are logged per run
+    CACHE.reset_stats()
+
+    own_session = session is None
+    try:
+        if own_session:
+            session = commvault_login()
+            logger.info('Commvault session is created')
+
+        resp_json = query_api(session, 'GET', 'ClientGroup')
+        client_groups = {item['name']: item['Id'] for item in resp_json['groups']}
+        logger.info(f'client groups: {len(client_groups)}')
+
+        # the subclients of all services are exported into one file
+        export_file = REPORTS_DIR / f'subclients_{datetime.now().strftime("%Y%m%d%H%M")}.jsonl'
+
+        # clients and their subclients are crawled by separate pools, so a client
+        # waiting for its subclients never holds a worker the subclients need
+        with ThreadPoolExecutor(WORKERS) as client_pool, \
+                ThreadPoolExecutor(WORKERS) as subclient_pool, \
+                (config.atomic_open(export_file) if export else nullcontext()) as export_stream:
+            for service_name in get_services_from_file():
+                logger.info(f'service: {service_name}')
+                client_group_id = client_groups[service_name]
+
+                resp_json = query_api(session, 'GET', f'ClientGroup/{client_group_id}')
+                clients = [(item['clientId'], item['clientName'])
+                           for item in resp_json['clientGroupDetail']['associatedClients']]
+                logger.info(f'clients: {clients}')
+
+                started = time.time()
+                previous = load_state(service_name) if incremental else {}
+                if previous:
+                    members = {str(client_id) for client_id, _ in clients}
+                    logger.info(f'new clients: {len(members - previous["clients"].keys())}, '
+                                f'removed clients: {len(previous["clients"].keys() - members)}')
+
+                # ordered_map() keeps the order of clients, so the report is the same
+                # as the sequential one regardless of the number of workers
+                states = ordered_map(
+                    client_pool,
+                    lambda client: get_client_details(session, subclient_pool, previous, *client),
+                    clients,
+                    window=WORKERS * 2,
+                )
+
+                current_time = datetime.now()
+
+                # each client's section is written as soon as the client is crawled,
+                # so only the clients being crawled are held in memory
+                report_name = f'{service_name}_{current_time.strftime("%Y%m%d%H%M")}.yml'
+                report_file = REPORTS_DIR / report_name
+                template = config.get_template(TEMPLATE_FILE.name)
+                with config.atomic_open(report_file) as report_stream, \
+                        config.atomic_open(STATE_DIR / f'{service_name}.json') as state_stream:
+                    servers = save_state(state_stream, started, clients, states,
+                                         flush=report_stream.flush)
+                    if export_stream:
+                        servers = export_subclients(export_stream, service_name, servers)
+                    template.stream(current_time=current_time,
+                                    service_name=service_name,
+                                    servers=servers).dump(report_stream)
+                logger.info(f'{report_file} is created')
+
+        if export:
+            logger.info(f'{export_file} is created')
+
+        for name, (hits, misses) in CACHE.stats().items():
+            logger.info(f'cache ({name}): {hits} hits, {misses} misses')
+    finally:
+        report('service-details')
+        if own_session and session is not None:
+            commvault_logout(session)
+            logger.info('Commvault session is closed')
+
+
+def get_client_details(session, subclient_pool, previous, client_id, client_name):
+    '''Collect the client's settings grouped by agents
+
+    The details from the previous run are reused if neither the client's
+    properties nor its subclients' ones have changed, it has no newer jobs and
+    the last ones have finished. The subclients are always listed with their
+    properties for the fingerprint, but they are used only with BULK_REQUESTS.
+    '''
+    logger.info(f'client: {client_name}')
+    subclients_json = query_api(session, 'GET', f'Subclient?clientId={client_id}'
+                                                f'&propertyLevel=20')
+    client_json = query_api(session, 'GET', f'Client/{client_id}')
+
+    fingerprint = hashlib.sha1(json.dumps([subclients_json, client_json],
+                                          sort_keys=True).encode()).hexdigest()
+    state = previous.get('clients', {}).get(str(client_id))
+    if (state and state['fingerprint'] == fingerprint and state.get('settled') and
+            not has_new_jobs(session, client_id, previous['created'], state['last_job_id'])):
+        logger.info(f'client: {client_name} is not changed')
+        return state
+
+    # (the subclient's entity, its properties if they are listed in full)
+    subclients = []
+    for node in subclients_json.get('subClientProperties', []):
+        subclients.append((node['subClientEntity'],
+                           node if BULK_REQUESTS and has_properties(node) else None))
+
+    client_props = client_json['clientProperties'][0]
+    operating_system = client_props['client']['osInfo']['OsDisplayInfo']['OSName']
+
+    virtual_machine = client_props.get('vmStatusInfo')
+    if virtual_machine and virtual_machine.get('subclientName'):
+        subclients.append((virtual_machine['vsaSubClientEntity'], None))
+    logger.info(f'subclients: {len(subclients)}')
+
+    jobs = {}
+    if BULK_REQUESTS and len(subclients) > 1:
+        jobs = get_client_jobs(session, client_id)
+
+    agents = defaultdict(list)
+    last_job_id = 0
+    settled = True
+    for agent, subclient in subclient_pool.map(
+            lambda item: get_subclient_details(session, *item, jobs=jobs), subclients):
+        agents[agent].append(subclient)
+        last_job_id = max(last_job_id, subclient['last_job'].get('id', 0))
+        # the client is crawled again while any of its last jobs is Running, Waiting, ...
+        if subclient['last_job'] and subclient['last_job']['status'] not in FINAL_STATUSES:
+            settled = False
+
+    # before: agents = {'agent_1': [subclients], ...}
+    # after:  agents = {'agent_1': {'backupsets': [subclients]}, ...}
+    for agent_name in agents:
+        if agents[agent_name][0]['backupset']:
+            agents[agent_name] = {'backupsets': agents[agent_name]}
+        else:
+            agents[agent_name] = {'instances': agents[agent_name]}
+
+    # before: agents = {'agent_1': {'backupsets': [subclients]}, ...}
+    # after:  agents = {'agent_1': {'backupsets': {'backupset_1': [subclients], ...}}, ...}
+    for agent_name in agents:
+        if agents[agent_name].get('backupsets'):
+            tmp = defaultdict(list)
+            for subclient in agents[agent_name]['backupsets']:
+                tmp[subclient['backupset']].append(subclient)
+            agents[agent_name]['backupsets'] = tmp
+        else:
+            tmp = defaultdict(list)
+            for subclient in agents[agent_name]['instances']:
+                tmp[subclient['instance']].append(subclient)
+            agents[agent_name]['instances'] = tmp
+
+    return {
+        'fingerprint': fingerprint,
+        'last_job_id': last_job_id,
+        'settled': settled,
+        'server': {
+            'hostname': client_name,
+            'os': operating_system,
+            'agents': agents,
+        },
+    }
+
+
+def has_new_jobs(session, client_id, since, last_job_id):
+    '''Check if the client has backup jobs newer than the last known one'''
+    # an hour is added to not miss jobs finished while the previous run
+    lookup_time = int(time.time() - since) + 3600
+    resp_json = query_api(session, 'GET', f'Job?clientId={client_id}&jobFilter=Backup&'
+                                          f'completedJobLookupTime={lookup_time}')
+    return any(job['jobSummary']['jobId'] > last_job_id
+               for job in resp_json.get('jobs', []))
+
+
+def has_properties(node):
+    '''Check if the listed subclient has all properties which are collected'''
+    common_properties = node.get('commonProperties', {})
+    return ('enableBackup' in common_properties and
+            'storageDevice' in common_properties and
+            (node['subClientEntity']['appName'] != 'File System' or 'content' in node))
+
+
+def get_client_jobs(session, client_id):
+    '''Request the client's backup jobs for JOBS_LOOKUP_TIME hours at once: {job_id: job_summary}'''
+    resp_json = query_api(session, 'GET', f'Job?clientId={client_id}&jobFilter=Backup&'
+                                          f'completedJobLookupTime={JOBS_LOOKUP_TIME * 3600}')
+    return {job['jobSummary']['jobId']: job['jobSummary']
+            for job in resp_json.get('jobs', []) if 'jobId' in job.get('jobSummary', {})}
+
+
+def get_subclient_details(session, node, subclient_props=None, jobs=None):
+    '''Collect the subclient's settings
+
+    The subclient's properties and its last job are requested one by one
+    unless they are given (see BULK_REQUESTS).
+    '''
+    subclient_id = node['subclientId']
+    subclient_name = node['subclientName']
+    logger.info(f'subclient: {subclient_name}')
+
+    agent = node['appName']
+    if agent in ('Oracle', 'SQL Server', 'MySQL'):
+        backupset = None
+        instance = node['instanceName']
+    else:
+        backupset = node['backupsetName']
+        instance = None
+
+    if not subclient_props:
+        resp_json = query_api(session, 'GET', f'Subclient/{subclient_id}')
+        subclient_props = resp_json['subClientProperties'][0]
+    subclient_status = subclient_props['commonProperties']['enableBackup']
+
+    last_job = {}
+    job_info = subclient_props['commonProperties'].get('lastBackupJobInfo')
+    if job_info and job_info.get('jobID'):
+        job_id = job_info['jobID']
+        job_summary = (jobs or {}).get(job_id)
+        if not job_summary:
+            resp_json = query_api(session, 'GET', f'Job/{job_id}')
+
+            try:
+                job_summary = resp_json['jobs'][0]['jobSummary']
+            except KeyError:
+                job_summary = {'status': 'Not Found',
+                               'jobStartTime': None,
+                               'jobEndTime': None}
+
+        last_job['id'] = job_id
+        last_job['status'] = job_summary['status']
+        last_job['started'] = timestamp_to_datetime(job_summary['jobStartTime'])
+        last_job['finished'] = timestamp_to_datetime(job_summary['jobEndTime'])
+
+    content = defaultdict(list)
+    if node['appName'] == 'File System':
+        for item in subclient_props['content']:
+            include = item.get('path') or item.get('includePath')
+            if include:
+                content['include'].append(include)
+            else:
+                content['exclude'].append(item['excludePath'])
+
+    resp_json = None
+    backup_storage_policy = subclient_props['commonProperties']['storageDevice']['dataBackupStoragePolicy']
+    if backup_storage_policy.get('storagePolicyId'):
+        policy_id = backup_storage_policy['storagePolicyId']
+        resp_json = query_api(session, 'GET', f'StoragePolicy/{policy_id}')
+
+    storage_policy = {}
+    if resp_json and resp_json.get('copy'):
+        retention = resp_json['copy'][0]['retentionRules']
+        retain_days = retention['retainBackupDataForDays']
+        retain_cycles = retention['retainBackupDataForCycles']
+        storage_policy['name'] = backup_storage_policy.get('storagePolicyName')
+        storage_policy['retention'] = f'{retain_days} days, {retain_cycles} cycles'
+
+    resp_json = query_api(session, 'GET', f'Schedules/?subclientId={subclient_id}')
+
+    schedules = []
+    if resp_json:
+        task = resp_json['taskDetail'][0]
+        for sub_task in task['subTasks']:
+            level = BACKUP_LEVEL[sub_task['options']['backupOpts']['backupLevel']]
+            description = sub_task['pattern']['description'].strip()
+            description = re.sub(' starting .+?and', 'and', description)
+            schedules.append({'type': level, 'pattern': description})
+
+    return agent, {
+        'name': subclient_name,
+        'backupset': backupset,
+        'instance': instance,
+        'status': subclient_status,
+        'content': content,
+        'storage_policy': storage_policy,
+        'schedules': schedules,
+        'last_job': last_job,
+    }
 
 
 def commvault_login():
-    '''Make login request'''
-    hostname = config.COMMVAULT['webconsole_hostname']
-    adapter = TimeoutHTTPAdapter(max_retries=RETRY_STRATEGY)
-
-    session = BaseUrlSession(f'http://{hostname}/webconsole/api/')
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    session.headers.update({'Accept': 'application/json',
-                            'Content-Type': 'application/json'})
-
-    resp_json = query_api(session, 'POST', 'Login', payload={
-        'mode': 4,
-        'username': config.COMMVAULT['commcell_username'],
-        'password': b64encode(config.COMMVAULT['commcell_password'].encode()).decode(),
-        'deviceId': socket.getfqdn(),
-        'clientType': 30,
-    })
-    session.headers['Authtoken'] = resp_json['token']
-    return session
+    '''Create the session with the stored token or make login request'''
+    http_cache = None
+    if HTTP_CACHE.get('enabled'):
+        http_cache = HTTPCache(HTTP_CACHE_FILE, HTTP_CACHE['max_age'])
+
+    # both pools (clients and subclients) can hold a connection at once
+    return create_session(RATE_LIMIT, max(WORKERS * 2, 10), http_cache)
 
 
 def commvault_logout(session):
-    '''Make logout request'''
-    query_api(session, 'POST', 'Logout')
+    '''Close the session and the persistent cache, the token is kept (see api.Commvault.close)'''
+    if session.http_cache:
+        logger.info(f'http cache: {session.http_cache.hits} hits, '
+                    f'{session.http_cache.revalidations} revalidated, '
+                    f'{session.http_cache.misses} misses')
+        session.http_cache.close()
     session.close()
 
 
 def query_api(session, method, path, payload=None):
     '''Make the API request to the Commcell'''
-    if method == 'POST' and not payload:
-        session.headers['Content-Type'] = 'application/xml'
-    else:
-        session.headers['Content-Type'] = 'application/json'
-
-    try:
-        response = session.request(method, path, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except JSONDecodeError:
-        return response
+    if method == 'GET':
+        return CACHE.get(path, partial(send_request, session, method, path))
+    return send_request(session, method, path, payload)
 
 
 def timestamp_to_datetime(timestamp):
     '''Convert timestamp to datetime instance'''
     if timestamp:
-        return datetime.fromtimestamp(timestamp).strftime('%T %d.%m.%Y')
+        return datetime.fromtimestamp(timestamp).strftime(DATETIME_FORMAT)
+
+
+def isoformat(value):
+    '''Convert the datetime of the report (see timestamp_to_datetime) to ISO 8601'''
+    if value:
+        return datetime.strptime(value, DATETIME_FORMAT).isoformat()
+
+
+def load_state(service_name):
+    '''Load the clients' details saved by the previous run'''
+    state_file = STATE_DIR / f'{service_name}.json'
+    if not state_file.exists():
+        logger.info(f'{state_file} is not found, all clients will be crawled')
+        return {}
+    state = json.loads(state_file.read_text(encoding='utf8'))
+    if time.time() - state['created'] > STATE_MAX_AGE * 3600:
+        logger.info(f'{state_file} is older than {STATE_MAX_AGE} hours, '
+                    f'all clients will be crawled')
+        return {}
+    return state
+
+
+def save_state(state_stream, started, clients, states, flush=None):
+    '''Yields the clients' servers while saving their details for the next incremental run
+
+    The details are written one by one, so they aren't held in memory together.
+    flush() is called after the consumer is done with each server.
+    '''
+    state_stream.write(f'{{"created": {json.dumps(started)}, "clients": {{')
+    for number, ((client_id, _), state) in enumerate(zip(clients, states)):
+        separator = ', ' if number else ''
+        state_stream.write(f'{separator}{json.dumps(str(client_id))}: {json.dumps(state)}')
+        yield state['server']
+        if flush:
+            flush()
+    state_stream.write('}}')
+
+
+def export_subclients(export_stream, service_name, servers):
+    '''Yields the servers while writing their subclients as JSON Lines, one subclient per line'''
+    for server in servers:
+        for agent_name, agent in server['agents'].items():
+            for collection_name, collection in agent.items():
+                for item_name, subclients in collection.items():
+                    for subclient in subclients:
+                        record = subclient_record(service_name, server, agent_name, subclient)
+                        export_stream.write(json.dumps(record) + '\n')
+        yield server
+
+
+def subclient_record(service_name, server, agent_name, subclient):
+    '''Returns the flat record of the subclient for the export'''
+    last_job = subclient['last_job']
+    storage_policy = subclient['storage_policy']
+    return {
+        'service': service_name,
+        'client': server['hostname'],
+        'os': server['os'],
+        'agent': agent_name,
+        'backupset': subclient['backupset'],
+        'instance': subclient['instance'],
+        'subclient': subclient['name'],
+        'enabled': subclient['status'],
+        'storage_policy': storage_policy.get('name'),
+        'retention': storage_policy.get('retention'),
+        'schedules': [f'{schedule["type"]}: {schedule["pattern"]}'
+                      for schedule in subclient['schedules']],
+        'include': subclient['content'].get('include', []),
+        'exclude': subclient['content'].get('exclude', []),
+        'last_job_id': last_job.get('id'),
+        'last_job_status': last_job.get('status'),
+        'last_job_started': isoformat(last_job.get('started')),
+        'last_job_finished': isoformat(last_job.get('finished')),
+    }
+
+
+def ordered_map(pool, function, items, window):
+    '''Like pool.map(), but only window items are submitted ahead of the consumer
+
+    So only the results which aren't consumed yet are held in memory.
+    '''
+    futures = deque()
+    for item in items:
+        futures.append(pool.submit(function, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
 
 
 def get_services_from_file():
@@ -286,4 +484,5 @@ def get_services_from_file():
 
 
 if __name__ == '__main__':
-    main()
+    main(incremental='incremental' in sys.argv[1:],
+         export='export' in sys.argv[1:])
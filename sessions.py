@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+Sessions to Jira and Commvault which can be shared between the scripts.
+'''
+from contextlib import contextmanager
+
+from jira import JIRA
+
+import config
+from api import Commvault, create_session
+from metrics import instrument_session
+
+
+@contextmanager
+def jira_session(jira=None):
+    '''Yields the given Jira session or a new one which is closed afterwards'''
+    if jira:
+        yield jira
+        return
+
+    jira = jira_login()
+    try:
+        yield jira
+    finally:
+        jira.close()
+
+
+def jira_login():
+    '''Returns the new Jira session which requests are recorded by metrics'''
+    jira = JIRA(**config.JIRA)
+    instrument_session(jira._session)
+    return jira
+
+
+@contextmanager
+def commvault_session(commvault=None):
+    '''Yields the given Commvault client or a new one which is closed afterwards'''
+    if commvault:
+        yield commvault
+        return
+
+    commvault = commvault_login()
+    try:
+        yield commvault
+    finally:
+        commvault.close()
+
+
+def commvault_login():
+    '''Returns the lean Commvault client with the stored token or logs in'''
+    settings = config.SETTINGS['commvault']
+    # a connection for each worker of the services' and the clients' pools
+    session = create_session(settings.get('rate_limit', 0),
+                             max(settings.get('workers', 1) * 2, 10))
+    return Commvault(session)
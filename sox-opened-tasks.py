@@ -5,60 +5,79 @@ and notifies service owner and backup admins if there are.
 '''
 from collections import defaultdict
 
-from jira import JIRA
-
 import config
-from config import logger, email
-from structures import Issue
+from config import logger
+from mailer import send_messages
+from metrics import report
+from sessions import jira_session
+from structures import Issue, poll_issues
 
 
 JIRA_PROJECT = 'SOX'
 LOOKUP_DAYS = 7
 
+# the number of SMTP connections which send the emails at once
+SMTP_CONNECTIONS = config.SETTINGS['smtp'].get('connections', 1)
+
 logger.add(sink=config.LOG_DIR / 'sox-opened-tasks.log',
            rotation=config.SETTINGS['logging']['rotation'],
            format=config.SETTINGS['logging']['format'],
-           level='INFO')
+           level='INFO',
+           filter=config.log_filter('sox-opened-tasks'))
 
 
 @logger.catch
-def main():
-    jira = JIRA(**config.JIRA)
-    jql = (f'project={JIRA_PROJECT} AND summary ~ JobSummary AND status = Open '
-           f'AND created > startOfDay(-{LOOKUP_DAYS}) AND created < now() '
-           f'ORDER BY key DESC')
+def main(jira=None):
+    try:
+        with jira_session(jira) as jira:
+            jql = (f'project={JIRA_PROJECT} AND summary ~ JobSummary AND status = Open '
+                   f'AND created > startOfDay(-{LOOKUP_DAYS}) AND created < now() '
+                   f'ORDER BY key DESC')
 
-    opened_issues = defaultdict(list)
-    for issue in jira.search_issues(jql, maxResults=False):
-        services = (config.SETTINGS['sox_services'] +
-                    config.SETTINGS['admin_services'])
-        for service_name in services:
-            if service_name in issue.fields.summary:
-                assignee = issue.fields.assignee.name
-                email_domain = config.SETTINGS['smtp']['domain']
-                email_address = f'{assignee}@{email_domain}'
-                issue.fields.summary = service_name
-                break
-        else:
-            logger.error(f'there is unknown service ({issue.fields.summary})')
-            continue
+            opened_issues = defaultdict(list)
+            # only the issues updated since the previous run are downloaded with their comments
+            for issue in poll_issues(jira, 'sox-opened-tasks', jql):
+                fields = issue['fields']
+                services = (config.SETTINGS['sox_services'] +
+                            config.SETTINGS['admin_services'])
+                for service_name in services:
+                    if service_name in fields['summary']:
+                        assignee = fields['assignee']['name']
+                        email_domain = config.SETTINGS['smtp']['domain']
+                        email_address = f'{assignee}@{email_domain}'
+                        fields['summary'] = service_name
+                        break
+                else:
+                    logger.error(f'there is unknown service ({fields["summary"]})')
+                    continue
 
-        comments = jira.comments(issue)
-        opened_issues[email_address].append(Issue(issue, comments))
+                opened_issues[email_address].append(Issue(issue))
 
-    for email_address, issues in opened_issues.items():
-        subject = f'{issues[0].summary} | Backup monitoring'
-        body = config.SOX_TEMPLATE.render(project=JIRA_PROJECT,
-                                          issues=issues,
-                                          wiki=config.SETTINGS['wiki'])
-        recipients = config.SMTP_PARAMS['to'] + [email_address]
-        email.notify(subject=subject, to=recipients, message=body)
-        logger.info(f'{len(opened_issues)} tasks are found')
+            # all emails are rendered first, then sent over the shared connections
+            messages = []
+            for email_address, issues in opened_issues.items():
+                messages.append({
+                    'subject': f'{issues[0].summary} | Backup monitoring',
+                    'to': config.SMTP_PARAMS['to'] + [email_address],
+                    'body': config.SOX_TEMPLATE.render(project=JIRA_PROJECT,
+                                                       issues=issues,
+                                                       wiki=config.SETTINGS['wiki']),
+                })
+            if messages:
+                logger.info(f'{len(opened_issues)} tasks are found')
 
-    if not opened_issues:
-        logger.info('nothing is found')
+            for message, result in zip(messages, send_messages(messages, SMTP_CONNECTIONS)):
+                sent = [recipient for recipient, error in result.items() if not error]
+                if sent:
+                    logger.info(f'{message["subject"]} is sent to {", ".join(sent)}')
+                for recipient, error in result.items():
+                    if error:
+                        logger.error(f'{message["subject"]} is not sent to {recipient}: {error}')
 
-    jira.close()
+            if not opened_issues:
+                logger.info('nothing is found')
+    finally:
+        report('sox-opened-tasks')
 
 
 if __name__ == '__main__':
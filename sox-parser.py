@@ -5,157 +5,270 @@ and closes the issue if it doesn't have critical/unknown errors.
 '''
 
 import re
-
-from jira import JIRA
-from cvpysdk.commcell import Commcell
-from cvpysdk.clientgroup import ClientGroup
-from cvpysdk.job import JobController
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import config
 from config import logger
+from cache import ResponseCache
+from jobs import FINAL_STATUSES, VMIndex, is_clean, iter_jobs, partition_jobs, vm_name
+from metrics import report
+from sessions import commvault_session, jira_session
+from structures import fetch_issues
 
 
 logger.add(sink=config.LOG_DIR / 'sox-parser.log',
            rotation=config.SETTINGS['logging']['rotation'],
            format=config.SETTINGS['logging']['format'],
-           level='INFO')
+           level='INFO',
+           filter=config.log_filter('sox-parser'))
+
+# the number of services (and clients) which are processed concurrently
+WORKERS = config.SETTINGS['commvault'].get('workers', 1)
+# the number of Jira issues which are updated concurrently
+JIRA_WORKERS = config.SETTINGS.get('jira_workers', 1)
+
+SUBCLIENT_DISABLED = re.compile('backup activity for subclient .+ is disabled',
+                                flags=re.IGNORECASE)
+
+
+class ErrorMatcher:
+    '''Finds known errors in the jobs' reasons with one precompiled pattern'''
+
+    def __init__(self, errors, wiki):
+        self.errors = []
+        for error in errors:
+            link = wiki + '/display/IDG/' + '+'.join(error.split())
+            self.errors.append((error, link))
+
+        # the lookahead matches at every position, so the errors which are
+        # overlapped by other ones (a part of a longer error) are found too
+        self.pattern = None
+        if errors:
+            self.pattern = re.compile('(?=' + '|'.join(f'({re.escape(error)})'
+                                                       for error in errors) + ')',
+                                      flags=re.IGNORECASE)
+
+    def match(self, reason):
+        '''Returns (error, link) of the known error found in the reason or None
+
+        If the reason contains several known errors, the first one
+        in the list of known errors is returned.
+        '''
+        if not self.pattern:
+            return None
+        indexes = [match.lastindex - 1 for match in self.pattern.finditer(reason)]
+        if indexes:
+            return self.errors[min(indexes)]
+
+
+KNOWN_ERRORS = ErrorMatcher(config.SETTINGS['known_errors'], config.SETTINGS['wiki'])
+
+# VMs of the Virtual Server jobs, each job is shared by many clients,
+# the details of the finished jobs are kept between the scheduler's runs
+JOB_DETAILS_TTL = {'JobDetails': 24 * 60 * 60}
+JOB_DETAILS_SIZE = 1024
+JOB_DETAILS = ResponseCache(JOB_DETAILS_TTL, JOB_DETAILS_SIZE)
 
 
 @logger.catch
-def main():
-    jira = JIRA(**config.JIRA)
-    commvault = Commcell(**config.COMMVAULT)
-    job_controller = JobController(commvault)
-
-    for service_name in config.SETTINGS['sox_services']:
-        client_group = ClientGroup(commvault, service_name)
-        clients = client_group.associated_clients
-
-        issues = []
-        for client_name in clients:
-            jobs = job_controller.all_jobs(
-                client_name=client_name,
-                job_summary='full',
-                limit=config.SETTINGS['commvault']['jobs_limit'],
-                lookup_time=config.SETTINGS['commvault']['lookup_time'],
+def main(jira=None, commvault=None):
+    # a service waits for its clients, so the clients have their own pool
+    try:
+        with jira_session(jira) as jira, commvault_session(commvault) as commvault, \
+                ThreadPoolExecutor(WORKERS) as service_pool, \
+                ThreadPoolExecutor(WORKERS) as client_pool:
+            services = config.SETTINGS['sox_services']
+            # the details of the active jobs change, so they are reused only in this run
+            active_job_details = ResponseCache(JOB_DETAILS_TTL, JOB_DETAILS_SIZE)
+            vm_index = partial(get_vm_index, commvault, active_job_details)
+
+            # {client_id: client_name} of each service
+            service_clients = list(service_pool.map(commvault.get_group_clients, services))
+
+            # jobs of all SOX clients are requested by one paged query
+            # and split by clients instead of one query per client,
+            # clean jobs are dropped as soon as their page is received
+            client_ids = sorted({client_id for clients in service_clients
+                                 for client_id in clients})
+            all_clients = sorted({client_name for clients in service_clients
+                                  for client_name in clients.values()})
+            jobs = {}
+            if all_clients:
+                jobs = partition_jobs(
+                    (job for job in iter_jobs(
+                        commvault, client_ids,
+                        lookup_time=config.SETTINGS['commvault']['lookup_time'],
+                        page_size=config.SETTINGS['commvault']['jobs_limit'],
+                    ) if not is_clean(job)),
+                    all_clients,
+                    vm_index=vm_index,
+                )
+            problematic_jobs = sum(len(client_jobs) for client_jobs in jobs.values())
+            logger.info(f'clients: {len(all_clients)}, problematic jobs: {problematic_jobs}')
+
+            results = service_pool.map(
+                lambda clients: get_service_issues(vm_index, client_pool, clients.values(), jobs),
+                service_clients
             )
-            for job_id in jobs:
-                job = jobs[job_id]
-                job_status = job['status'].lower()
-                job_failed_files = job['totalFailedFiles']
-                job_failed_folders = job['totalFailedFolders']
-
-                if (job_status == 'completed' and (
-                        not (job_failed_files or job_failed_folders) or
-                        job['appTypeName'] == 'Virtual Server')):
-                    continue
-
-                issue = {
-                    'job_id': job_id,
-                    'client': client_name,
-                    'status': job_status,
-                    'percent': job['percentComplete'],
-                    'reason': '',
-                    'comment': '',
-                }
-                logger.info(f'client={issue["client"]} '
-                            f'job_id={issue["job_id"]} '
-                            f'status={issue["status"]} '
-                            f'failed_files={job_failed_files} '
-                            f'failed_folders={job_failed_folders}')
-
-                if job_status in ['running', 'waiting']:
-                    message = f'Progress: {job["percentComplete"]}%'
-                    issue['comment'] = make_comment(issue, message)
-
-                elif job_status in ['pending', 'failed', 'killed',
-                                    'suspended', 'failed to start']:
-                    issue['reason'] = job['pendingReason']
-                    pattern = 'backup activity for subclient .+ is disabled'
-                    if re.match(pattern, issue['reason'], flags=re.IGNORECASE):
-                        issue['reason'] = ('Backup activity for subclient '
-                                           'is disabled')
-
-                elif (job_status == 'completed' and
-                        (job_failed_files or job_failed_folders)):
-                    issue['reason'] = (f'Failed to back up: '
-                                       f'{job_failed_folders} Folders, '
-                                       f'{job_failed_files} Files')
-
-                elif (job['appTypeName'] == 'Virtual Server' and
-                        job_status == 'completed w/ one or more errors'):
-                    issue['reason'] = job_status
-                    job_detail = job_controller.get(job_id).details['jobDetail']
-                    vms = job_detail['clientStatusInfo']['vmStatus']
-
-                    # After restoring VM with new name, Commvault renames old client name
-                    # For example, src: srv-tibload-001, dest: srv-tibload-001_20102020
-                    client_vm_name = client_name.split('_')[0]
-
-                    vm_found = False
-                    for vm in vms:
-                        if vm['vmName'].startswith(client_vm_name):
-                            vm_found = True
-                            issue['reason'] = vm['FailureReason']
-                            break
-
-                    if not vm_found:
-                        logger.error(f'{client_vm_name} is not found '
-                                     f'in the job ({job_id})')
-
-                elif job_status == 'completed w/ one or more errors':
-                    issue['reason'] = job['pendingReason']
-
-                elif job_status == 'committed':
-                    issue['reason'] = ('Job was cancelled, but '
-                                       'some items successfully backed up')
-
-                else:
-                    logger.error(f'undefined job: {job}')
-
-                if issue['reason'] and not issue['comment']:
-                    for error in config.SETTINGS['known_errors']:
-                        if error.lower() in issue['reason'].lower():
-                            link = config.SETTINGS['wiki'] + '/display/IDG/'
-                            link += '+'.join(error.split())
-                            message = f'[{error}|{link}]'
-                            issue['comment'] = make_comment(issue, message)
-                            break
-
-                issues.append(issue)
-
-        comment = ''
-        issue_can_be_closed = True
-        for issue in issues:
-            if not issue['comment']:
-                issue_can_be_closed = False
-                reason = make_comment(issue, issue['reason'])
-                comment += f'{reason}\n'
-            else:
-                comment += f'{issue["comment"]}\n'
 
-        if not comment:
-            comment = 'No problem was found'
+            # today's issues of all services are found by one search
+            jira_issues = get_jira_issues(jira, services)
+
+            # each issue is commented and closed by one task, once per service
+            with ThreadPoolExecutor(JIRA_WORKERS) as jira_pool:
+                updates = [jira_pool.submit(update_jira_issue, jira, service_name,
+                                            jira_issues.get(service_name), issues)
+                           for service_name, issues in zip(services, results)]
+            for update in updates:
+                update.result()
+    finally:
+        report('sox-parser')
+
+
+def get_service_issues(vm_index, client_pool, clients, jobs):
+    '''Collects the problematic jobs of all clients of the service'''
+    issues = []
+    for client_issues in client_pool.map(
+            lambda client_name: get_client_issues(vm_index, client_name,
+                                                  jobs.get(client_name.lower(), {})),
+            clients):
+        issues.extend(client_issues)
+    return issues
+
+
+def get_client_issues(vm_index, client_name, jobs):
+    '''Collects the problematic jobs of the client, vm_index(job) returns VMIndex of the job'''
+    issues = []
+    for job_id in jobs:
+        job = jobs[job_id]
+        job_status = job['status'].lower()
+        job_failed_files = job['totalFailedFiles']
+        job_failed_folders = job['totalFailedFolders']
+
+        issue = {
+            'job_id': job_id,
+            'client': client_name,
+            'status': job_status,
+            'percent': job['percentComplete'],
+            'reason': '',
+            'comment': '',
+        }
+        logger.info(f'client={issue["client"]} '
+                    f'job_id={issue["job_id"]} '
+                    f'status={issue["status"]} '
+                    f'failed_files={job_failed_files} '
+                    f'failed_folders={job_failed_folders}')
+
+        if job_status in ['running', 'waiting']:
+            message = f'Progress: {job["percentComplete"]}%'
+            issue['comment'] = make_comment(issue, message)
+
+        elif job_status in ['pending', 'failed', 'killed',
+                            'suspended', 'failed to start']:
+            issue['reason'] = job['pendingReason']
+            if SUBCLIENT_DISABLED.match(issue['reason']):
+                issue['reason'] = ('Backup activity for subclient '
+                                   'is disabled')
+
+        elif (job_status == 'completed' and
+                (job_failed_files or job_failed_folders)):
+            issue['reason'] = (f'Failed to back up: '
+                               f'{job_failed_folders} Folders, '
+                               f'{job_failed_files} Files')
+
+        elif (job['appTypeName'] == 'Virtual Server' and
+                job_status == 'completed w/ one or more errors'):
+            issue['reason'] = job_status
+            client_vm_name = vm_name(client_name)
+            reason = vm_index(job).find(client_vm_name)
+
+            if reason is not None:
+                issue['reason'] = reason
+            else:
+                logger.error(f'{client_vm_name} is not found '
+                             f'in the job ({job_id})')
 
-        jql = (f'project = SOX AND '
-               f'summary ~ "JobSummary_\\\\[{service_name}\\\\]" AND '
-               f'created >= startOfDay()')
-        issue = jira.search_issues(jql, validate_query=True)[0]
-        issue_status = issue.fields.status.name.lower()
+        elif job_status == 'completed w/ one or more errors':
+            issue['reason'] = job['pendingReason']
 
-        if issue_status == 'open':
-            jira.add_comment(issue.key, comment)
-            comment = comment.replace('\n', '|')
+        elif job_status == 'committed':
+            issue['reason'] = ('Job was cancelled, but '
+                               'some items successfully backed up')
 
-            if issue_can_be_closed:
-                # list of transitions /rest/api/2/issue/${issueIdOrKey}/transitions
-                jira.transition_issue(issue=issue.key, transition='Close')
-                logger.info(f'{service_name} ({issue.key}) has been closed')
         else:
-            logger.info(f'{service_name} ({issue.key}) has already been closed')
+            logger.error(f'undefined job: {job}')
+
+        if issue['reason'] and not issue['comment']:
+            known_error = KNOWN_ERRORS.match(issue['reason'])
+            if known_error:
+                error, link = known_error
+                issue['comment'] = make_comment(issue, f'[{error}|{link}]')
+
+        issues.append(issue)
+    return issues
+
+
+def get_jira_issues(jira, services):
+    '''Finds today's JobSummary issues of the services: {service_name: issue}'''
+    jql = ('project = SOX AND summary ~ "JobSummary" AND '
+           'created >= startOfDay()')
+
+    jira_issues = {}
+    for issue in fetch_issues(jira, jql, fields=['summary', 'status']):
+        for service_name in services:
+            if f'JobSummary_[{service_name}]' in issue['fields']['summary']:
+                jira_issues.setdefault(service_name, issue)
+    return jira_issues
+
+
+def update_jira_issue(jira, service_name, jira_issue, issues):
+    '''Leaves the comment in the service's issue and closes it if possible'''
+    if not jira_issue:
+        logger.error(f"{service_name}: today's issue is not found")
+        return
+
+    comment = ''
+    issue_can_be_closed = True
+    for issue in issues:
+        if not issue['comment']:
+            issue_can_be_closed = False
+            reason = make_comment(issue, issue['reason'])
+            comment += f'{reason}\n'
+        else:
+            comment += f'{issue["comment"]}\n'
+
+    if not comment:
+        comment = 'No problem was found'
+
+    issue_key = jira_issue['key']
+    issue_status = jira_issue['fields']['status']['name'].lower()
+
+    if issue_status == 'open':
+        jira.add_comment(issue_key, comment)
+        comment = comment.replace('\n', '|')
+
+        if issue_can_be_closed:
+            # list of transitions /rest/api/2/issue/${issueIdOrKey}/transitions
+            jira.transition_issue(issue=issue_key, transition='Close')
+            logger.info(f'{service_name} ({issue_key}) has been closed')
+    else:
+        logger.info(f'{service_name} ({issue_key}) has already been closed')
+
+
+def get_vm_index(commvault, active_job_details, job):
+    '''Returns VMIndex of the Virtual Server job
+
+    The details of the finished jobs are cached in JOB_DETAILS,
+    the details of the active ones in active_job_details.
+    '''
+    job_id = job['jobId']
 
-    jira.close()
-    commvault.logout()
+    def load():
+        job_detail = commvault.get_job_details(job_id)
+        return VMIndex(job_detail.get('clientStatusInfo', {}).get('vmStatus', []))
+    job_details = JOB_DETAILS if job['status'] in FINAL_STATUSES else active_job_details
+    return job_details.get(f'JobDetails/{job_id}', load)
 
 
 def make_comment(issue, message):
@@ -1,21 +1,132 @@
 #!/usr/bin/env python3
 import re
+import json
 from datetime import datetime
 
-from config import SETTINGS
+import config
+
+
+# the fields of the issues which are used by Issue
+ISSUE_FIELDS = ['summary', 'created', 'assignee', 'reporter', 'status', 'comment']
+
+# the issues of the previous runs of poll_issues()
+JIRA_STATE_DIR = config.STATE_DIR / 'jira'
+
+# Jira markup of the comments: {code}, {color:red}, ...
+COMMENT_MARKUP = re.compile('{.+?}')
+
+
+def fetch_issues(jira, jql, fields=ISSUE_FIELDS, page_size=100):
+    '''Yields raw Jira issues with the fields (comments are embedded) page by page'''
+    start = 0
+    while True:
+        result = jira.search_issues(jql, startAt=start, maxResults=page_size,
+                                    fields=fields, json_result=True)
+        for issue in result['issues']:
+            complete_comments(jira, issue)
+            yield issue
+
+        start += len(result['issues'])
+        if not result['issues'] or start >= result['total']:
+            break
+
+
+def complete_comments(jira, issue):
+    '''Requests all comments of the issue if the search has embedded only a part of them'''
+    comment = issue['fields'].get('comment')
+    if comment and comment['total'] > len(comment['comments']):
+        comment['comments'] = [item.raw for item in jira.comments(issue['key'])]
+        comment['total'] = len(comment['comments'])
+
+
+def poll_issues(jira, name, jql, fields=ISSUE_FIELDS, page_size=100):
+    '''Returns raw Jira issues of the JQL, only new and updated ones are downloaded
+
+    The issues of the previous run are kept in JIRA_STATE_DIR/<name>.json.
+    The JQL is listed with the field updated only, so the issues which have left
+    the filter (closed, too old, ...) are dropped, and the issues whose updated
+    differs from the stored one are requested with all fields by their keys.
+    '''
+    state_file = JIRA_STATE_DIR / f'{name}.json'
+    fields = [*fields, 'updated']
+    stored = load_issues(state_file, jql)
+
+    if stored is None:
+        issues = [compact_issue(issue) for issue in fetch_issues(jira, jql, fields, page_size)]
+    else:
+        keys = []
+        changed = []
+        for issue in fetch_issues(jira, jql, fields=['updated'], page_size=page_size):
+            keys.append(issue['key'])
+            if (issue['key'] not in stored or
+                    stored[issue['key']]['fields']['updated'] != issue['fields']['updated']):
+                changed.append(issue['key'])
+
+        for start in range(0, len(changed), page_size):
+            key_jql = f'key in ({", ".join(changed[start:start + page_size])})'
+            for issue in fetch_issues(jira, key_jql, fields, page_size):
+                stored[issue['key']] = compact_issue(issue)
+        # the issues are kept in the order of the JQL
+        issues = [stored[key] for key in keys if key in stored]
+
+    save_issues(state_file, jql, issues)
+    return issues
+
+
+def compact_issue(issue):
+    '''Keeps only the key and the fields of the raw issue'''
+    return {'key': issue['key'], 'fields': issue['fields']}
+
+
+def load_issues(state_file, jql):
+    '''Returns the stored issues of the JQL: {key: issue}, None if there are no such ones'''
+    try:
+        state = json.loads(state_file.read_text(encoding='utf8'))
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get('jql') != jql:
+        return None
+    return {issue['key']: issue for issue in state['issues']}
+
+
+def save_issues(state_file, jql, issues):
+    '''Replaces the stored issues atomically, so a broken run leaves the previous ones'''
+    state_file.parent.mkdir(exist_ok=True)
+    with config.atomic_open(state_file) as file:
+        json.dump({'jql': jql, 'issues': issues}, file)
 
 
 class Issue:
-    'Structure containing information about a Jira issue'
-    def __init__(self, issue, comments):
-        self.key = issue.key
-        self.created = self._parse_created(issue.fields.created)
-        self.summary = issue.fields.summary
-        self.assignee = issue.fields.assignee.displayName
-        self.reporter = issue.fields.reporter.displayName
-        self.status = issue.fields.status.name
-        self.comments = self._parse_comments(comments)
-        self.href = f'{SETTINGS["jira"]}/browse/{issue.key}'
+    '''Structure containing information about a Jira issue
+
+    The comments are normalized when they are read for the first time,
+    so the issues whose comments aren't rendered don't pay for it.
+    '''
+    __slots__ = ('key', 'created', 'summary', 'assignee', 'reporter', 'status', 'href',
+                 '_raw_comments', '_comments')
+
+    def __init__(self, issue):
+        fields = issue['fields']
+        self.key = issue['key']
+        self.created = self._parse_created(fields['created'])
+        self.summary = fields['summary']
+        self.assignee = fields['assignee']['displayName']
+        self.reporter = fields['reporter']['displayName']
+        self.status = fields['status']['name']
+        self.href = f'{config.SETTINGS["jira"]}/browse/{issue["key"]}'
+        # only the authors and bodies of the comments are kept until they are read
+        self._raw_comments = [(comment['author']['displayName'] if 'author' in comment
+                               else 'Anonymous', comment['body'])
+                              for comment in fields['comment']['comments']]
+        self._comments = None
+
+    @property
+    def comments(self):
+        '''One line comments with their authors'''
+        if self._comments is None:
+            self._comments = self._parse_comments(self._raw_comments)
+            self._raw_comments = None
+        return self._comments
 
     def _parse_created(self, created):
         '''Converts Jira datetime format to dd.mm.YYYY'''
@@ -25,16 +136,11 @@ class Issue:
     def _parse_comments(self, comments):
         '''Parses multiline Jira comments to one line strings'''
         items = []
-        for comment in comments:
-            comment.body = comment.body.replace('\r\n', ' ')
-            comment.body = comment.body.replace('\n', ' ')
-            comment.body = re.sub('{.+?}', '', comment.body)
-            comment.body = re.sub('\\xa0', ' ', comment.body)
-
-            if hasattr(comment, 'author'):
-                if comment.author.displayName == 'A1 JIRA': continue
-                message = f'({comment.author.displayName}): {comment.body}'
-            else:
-                message = f'(Anonymous): {comment.body}'
-            items.append(message)
+        for author, body in comments:
+            if author == 'A1 JIRA': continue
+
+            body = body.replace('\r\n', ' ').replace('\n', ' ').replace('\xa0', ' ')
+            if '{' in body:
+                body = COMMENT_MARKUP.sub('', body)
+            items.append(f'({author}): {body}')
         return items
@@ -5,41 +5,114 @@ It suspends/resumes Data Verification jobs.
 It make a decision with the first CLI argument (resume/suspend).
 '''
 import sys
-
-from cvpysdk.commcell import Commcell
-from cvpysdk.job import JobController
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import config
 from config import logger
+from api import CommvaultError
+from metrics import report
+from sessions import commvault_session
 
 
 logger.add(sink=config.LOG_DIR / 'suspend-jobs.log',
            rotation=config.SETTINGS['logging']['rotation'],
            format=config.SETTINGS['logging']['format'],
-           level='INFO')
+           level='INFO',
+           filter=config.log_filter('suspend-jobs'))
+
+# DATA_VERIFICATION
+JOB_TYPES = [31]
+
+# action: (current status, expected status, past tense)
+ACTIONS = {
+    'resume': ('Suspended', 'Running', 'resumed'),
+    'suspend': ('Running', 'Suspended', 'suspended'),
+}
+
+# the number of jobs which are suspended/resumed concurrently
+WORKERS = config.SETTINGS['commvault'].get('workers', 1)
+
+# seconds to wait for all jobs to change the status and between the checks
+TIMEOUT = 360
+POLL_INTERVAL = 3
+
+# the status of a job which isn't in the list of active jobs anymore
+FINISHED = 'Finished'
 
 
 @logger.catch
-def main():
-    commvault = Commcell(**config.COMMVAULT)
-    job_controller = JobController(commvault)
+def main(action, commvault=None):
+    if action not in ACTIONS:
+        logger.error(f'unknown action ({action}), expected: {", ".join(ACTIONS)}')
+        return
+    current_status, expected_status, done = ACTIONS[action]
+
+    try:
+        with commvault_session(commvault) as commvault:
+            jobs = get_active_jobs(commvault)
+            job_ids = [job_id for job_id in jobs if jobs[job_id]['status'] == current_status]
+
+            # the requests are sent at once, then all jobs are polled together
+            with ThreadPoolExecutor(WORKERS) as pool:
+                errors = dict(zip(job_ids, pool.map(
+                    lambda job_id: send_action(commvault, job_id, action),
+                    job_ids
+                )))
+            statuses = wait_for_status(commvault,
+                                       [job_id for job_id in job_ids if not errors[job_id]],
+                                       expected_status)
+
+            for job_id in job_ids:
+                if errors[job_id]:
+                    logger.error(f'job ({job_id}) has not been {done}: {errors[job_id]}')
+                elif statuses[job_id] == expected_status:
+                    logger.info(f'job ({job_id}) has been {done}')
+                elif statuses[job_id] == FINISHED:
+                    logger.info(f'job ({job_id}) has finished before it has been {done}')
+                else:
+                    logger.error(f'job ({job_id}) has not been {done} '
+                                 f'in {TIMEOUT} seconds, status: {statuses[job_id]}')
+    finally:
+        report('suspend-jobs')
+
+
+def get_active_jobs(commvault):
+    '''Returns the active Data Verification jobs: {job_id: job}'''
+    return commvault.get_active_jobs(JOB_TYPES, config.SETTINGS['commvault']['jobs_limit'])
 
-    # DATA_VERIFICATION
-    jobs = job_controller.active_jobs(job_type_list=[31])
 
-    for job_id in jobs:
-        job = job_controller.get(job_id)
+def send_action(commvault, job_id, action):
+    '''Sends the request to suspend/resume the job without waiting, returns the error if any'''
+    try:
+        if action == 'suspend':
+            commvault.pause_job(job_id)
+        else:
+            commvault.resume_job(job_id)
+    except CommvaultError as error:
+        return str(error)
 
-        if job.status == 'Suspended' and sys.argv[1] == 'resume':
-            job.resume(wait_for_job_to_resume=True)
-            logger.info(f'job ({job_id}) has been resumed')
 
-        elif job.status == 'Running' and sys.argv[1] == 'suspend':
-            job.pause(wait_for_job_to_pause=True)
-            logger.info(f'job ({job_id}) has been suspended')
+def wait_for_status(commvault, job_ids, status):
+    '''Polls the jobs together until all of them have the status or TIMEOUT expires'''
+    deadline = time.monotonic() + TIMEOUT
+    statuses = {}
+    pending = set(job_ids)
+    while pending:
+        # one request returns the statuses of all jobs,
+        # a finished job isn't in the list of active jobs anymore
+        jobs = get_active_jobs(commvault)
+        for job_id in list(pending):
+            statuses[job_id] = jobs[job_id]['status'] if job_id in jobs else FINISHED
+            if statuses[job_id] in (status, FINISHED):
+                pending.discard(job_id)
 
-    commvault.logout()
+        if pending and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+        else:
+            break
+    return statuses
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+Commvault auth token which is shared between the scripts' processes.
+
+The token is stored in STATE_DIR readable only by its owner, and a file
+lock makes concurrent scripts wait for the one which is logging in.
+'''
+import json
+import fcntl
+from contextlib import contextmanager
+
+import config
+
+
+TOKEN_FILE = config.STATE_DIR / 'commvault.token'
+LOCK_FILE = config.STATE_DIR / 'commvault.lock'
+
+
+def get_token(is_valid, login):
+    '''Returns the stored token if is_valid(token), otherwise the one from login()'''
+    token = load_token()
+    if token and is_valid(token):
+        return token
+
+    with token_lock():
+        # another process could have logged in while this one was waiting
+        token = load_token()
+        if token and is_valid(token):
+            return token
+
+        token = login()
+        save_token(token)
+        return token
+
+
+def invalidate_token(token):
+    '''Removes the stored token unless it has been already replaced'''
+    with token_lock():
+        if load_token() == token:
+            TOKEN_FILE.unlink()
+
+
+def load_token():
+    '''Returns the stored token of the current user or None'''
+    try:
+        stored = json.loads(TOKEN_FILE.read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return None
+    if stored.get('username') == config.COMMVAULT['commcell_username']:
+        return stored.get('token')
+
+
+def save_token(token):
+    '''Stores the token readable only by the owner'''
+    with config.atomic_open(TOKEN_FILE, permissions=0o600) as file:
+        json.dump({'username': config.COMMVAULT['commcell_username'],
+                   'token': token}, file)
+
+
+@contextmanager
+def token_lock():
+    '''Holds the exclusive lock of the token between the processes'''
+    with LOCK_FILE.open('w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)